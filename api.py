@@ -0,0 +1,378 @@
+"""
+Lightweight JSON price API served from the shared PricePoller snapshot.
+
+Runs inside the Streamlit process when GOLD_API_PORT is set (see app.py),
+or standalone with its own poller:
+    python api.py [--host 0.0.0.0] [--port 8502]
+
+Endpoints:
+    GET /api/prices                     latest GTA snapshot
+    GET /api/rates                      calibrated CNY/THB rates
+    GET /api/history?period=1M          chart-ready history (1W, 1M, 1Y, 3Y or All; rollups for long periods)
+    GET /api/history?start=...&end=...  raw rows with start <= timestamp < end (candles past MAX_ROWS)
+    GET /api/indicators?period=1M       latest indicators plus per-point series for the period
+    GET /api/stream                     Server-Sent Events: full state, then diffs
+    GET /metrics                        Prometheus text: stage latencies and counters
+
+For local testing, `python api.py --stub` replaces GTA and open.er-api with
+a random-walk source that changes every --interval seconds.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from utils import AlertManager, DataManager, Metrics, PricePoller, PRICE_COLUMNS
+
+
+class BadRequest(ValueError):
+    """Invalid query parameters; answered with a 400 and this message."""
+
+
+class Unavailable(Exception):
+    """No snapshot has been published yet; answered with a 503 and Retry-After."""
+
+
+class PriceAPI:
+    """Builds and caches encoded JSON responses so repeat polls cost a dict lookup."""
+    SNAPSHOT_MAX_AGE = 30 # Cache-Control for prices/rates, seconds
+    HISTORY_MAX_AGE = 300
+    HISTORY_TTL = 60 # How long an encoded history response is reused
+    CACHE_SIZE = 128 # Encoded responses kept, least recently used evicted first
+    CACHE_BYTES = 64 * 1024 * 1024 # ...and their total size
+    MAX_ROWS = 5000 # start/end ranges holding more raw rows are answered with rollup candles
+    SNAPSHOT_WAIT = 2 # Seconds a request waits for the poller's first snapshot
+    RETRY_AFTER = 5 # Seconds clients are told to wait when there is none yet
+    PERIODS = list(DataManager.PERIOD_DAYS) + ["All"]
+
+    def __init__(self, poller):
+        self.poller = poller
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def encode(payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        return body, '"%s"' % hashlib.sha1(body).hexdigest()
+
+    def _cached(self, key, version, build):
+        """Returns (body, etag), rebuilding only when version changes."""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] == version:
+                self._cache.move_to_end(key)
+                return entry[1], entry[2]
+        body, etag = self.encode(build())
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old:
+                self._cache_bytes -= len(old[1])
+            self._cache[key] = (version, body, etag)
+            self._cache_bytes += len(body)
+            while len(self._cache) > self.CACHE_SIZE or self._cache_bytes > self.CACHE_BYTES:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted[1])
+        return body, etag
+
+    @staticmethod
+    def period(query):
+        period = query.get("period", ["1M"])[0]
+        if period not in PriceAPI.PERIODS:
+            raise BadRequest(f"period must be one of {', '.join(PriceAPI.PERIODS)}")
+        return period
+
+    @staticmethod
+    def timestamp(query, name):
+        value = query.get(name, [None])[0]
+        if value is None:
+            return None
+        try:
+            ts = pd.Timestamp(value)
+        except (ValueError, TypeError):
+            ts = pd.NaT
+        if pd.isna(ts) or ts.tzinfo is not None:
+            raise BadRequest(f"{name} must be a local date/time such as 2024-01-31 or 2024-01-31T09:30")
+        return ts
+
+    def snapshot(self):
+        snap = self.poller.snapshot(timeout=self.SNAPSHOT_WAIT)
+        if snap is None:
+            raise Unavailable("no prices yet")
+        return snap
+
+    def prices(self):
+        snap = self.snapshot()
+        return self._cached("prices", snap["seq"], lambda: {
+            "prices": dict(snap["prices"]) if snap["prices"] else None,
+            "fetched_at": snap["fetched_at"],
+        }), self.SNAPSHOT_MAX_AGE
+
+    def rates(self):
+        snap = self.snapshot()
+        return self._cached("rates", snap["seq"], lambda: {
+            "rates": dict(snap["rates"]) if snap["rates"] else None,
+            "fetched_at": snap["fetched_at"],
+        }), self.SNAPSHOT_MAX_AGE
+
+    def history(self, query):
+        start, end = self.timestamp(query, "start"), self.timestamp(query, "end")
+        period = None if start is not None or end is not None else self.period(query)
+
+        def build():
+            if period is None:
+                level, df = DataManager.history_for_range(start, end, self.MAX_ROWS)
+            else:
+                level, df = DataManager.history_for_chart(period)
+            columns = [c for c in ["timestamp"] + PRICE_COLUMNS + ["update_time"] if c in df.columns]
+            rows = df[columns].reset_index(drop=True)
+            if not rows.empty:
+                rows["timestamp"] = rows["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")
+            return {"level": level, "rows": json.loads(rows.to_json(orient="records"))}
+
+        key = ("history", period, start, end)
+        version = int(time.time() // self.HISTORY_TTL)
+        return self._cached(key, version, build), self.HISTORY_MAX_AGE
+
+    def indicators(self, query):
+        period = self.period(query)
+
+        def build():
+            level, df = DataManager.indicator_series(period)
+            columns = ["timestamp", "bullion_sell", "ma_short", "ma_long", "volatility", "drawdown", "spread"]
+            rows = df[columns] if not df.empty else pd.DataFrame(columns=columns)
+            if not rows.empty:
+                rows = rows.assign(timestamp=rows["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S"))
+            return {
+                "latest": DataManager.indicators(),
+                "level": level,
+                "rows": json.loads(rows.to_json(orient="records")),
+            }
+
+        version = int(time.time() // self.HISTORY_TTL)
+        return self._cached(("indicators", period), version, build), self.HISTORY_MAX_AGE
+
+    def route(self, path, query):
+        """Returns ((body, etag), max_age) or None for unknown paths."""
+        if path == "/api/prices":
+            return self.prices()
+        if path == "/api/rates":
+            return self.rates()
+        if path == "/api/history":
+            return self.history(query)
+        if path == "/api/indicators":
+            return self.indicators(query)
+        return None
+
+
+class PriceBroadcaster:
+    """
+    Turns poller snapshots into a stream of compact diffs. A frame is built
+    only when the GTA update_time, the stale flag or the calibrated rate
+    changes; it is encoded once and every connected client is woken with one
+    notify_all. Recent frames are kept so reconnecting clients can resume by
+    event id ("<run>-<seq>"; ids from another server run get a full snapshot).
+    """
+    HISTORY = 100 # frames kept for Last-Event-ID resume
+    KEEPALIVE = 15 # seconds between comment pings on idle streams
+
+    def __init__(self, poller):
+        import secrets
+        self.run = secrets.token_hex(4) # Per-process nonce: seq restarts at 0 with every run
+        self.seq = 0
+        self.state = {}
+        self._frames = deque(maxlen=self.HISTORY)
+        self._cond = threading.Condition()
+        poller.subscribe(self.on_snapshot)
+
+    @staticmethod
+    def flatten(snap):
+        state = {}
+        if snap and snap["prices"]:
+            for key in PRICE_COLUMNS + ["update_time", "stale"]:
+                state[key] = snap["prices"].get(key)
+        if snap and snap["rates"]:
+            state["rate_buy"] = snap["rates"].get("buy")
+            state["rate_sell"] = snap["rates"].get("sell")
+        return state
+
+    def frame(self, event, seq, payload):
+        data = json.dumps(payload, ensure_ascii=False, default=str)
+        return f"id: {self.run}-{seq}\nevent: {event}\ndata: {data}\n\n".encode("utf-8")
+
+    def on_snapshot(self, snap):
+        state = self.flatten(snap)
+        with self._cond:
+            old = self.state
+            if old and all(state.get(k) == old.get(k) for k in ("update_time", "stale", "rate_buy")):
+                return
+            diff = {k: v for k, v in state.items() if old.get(k) != v}
+            self.seq += 1
+            self.state = state
+            self._frames.append((self.seq, self.frame("price", self.seq, diff)))
+            self._cond.notify_all()
+
+    def initial(self):
+        """Full current state as a "snapshot" event plus its sequence number."""
+        with self._cond:
+            return self.seq, self.frame("snapshot", self.seq, self.state)
+
+    def resume_seq(self, last_event_id):
+        """
+        The seq to resume after for a Last-Event-ID, or None when the id is
+        from another run, malformed, or older than the frames still kept.
+        """
+        run, _, seq = (last_event_id or "").rpartition("-")
+        if run != self.run or not seq.isdigit():
+            return None
+        last_seq = int(seq)
+        with self._cond:
+            oldest = self._frames[0][0] if self._frames else self.seq + 1
+            return last_seq if oldest - 1 <= last_seq <= self.seq else None
+
+    def wait(self, last_seq, timeout=None):
+        """Blocks until frames newer than last_seq exist; returns them (may be empty)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > last_seq, timeout or self.KEEPALIVE)
+            return [f for f in self._frames if f[0] > last_seq]
+
+
+class PriceAPIHandler(BaseHTTPRequestHandler):
+    api = None # Set by serve()
+    broadcaster = None
+    protocol_version = "HTTP/1.1" # keep-alive for pollers
+    disable_nagle_algorithm = True # headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/api/stream":
+            return self.stream()
+        if url.path == "/metrics":
+            return self.metrics()
+        try:
+            result = self.api.route(url.path, parse_qs(url.query))
+        except BadRequest as e:
+            return self._send(400, *self.api.encode({"error": str(e)}), max_age=0)
+        except Unavailable as e:
+            return self._send(503, *self.api.encode({"error": str(e)}), max_age=0, retry_after=self.api.RETRY_AFTER)
+        except Exception as e:
+            print(f"API error: {e}")
+            return self._send(500, *self.api.encode({"error": "internal error"}), max_age=0)
+        if result is None:
+            return self._send(404, *self.api.encode({"error": "not found"}), max_age=0)
+        (body, etag), max_age = result
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304, b"", etag, max_age)
+        self._send(200, body, etag, max_age)
+
+    def stream(self):
+        """Server-Sent Events: one snapshot event, then diffs as they happen."""
+        broadcaster = self.broadcaster
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            last_seq = broadcaster.resume_seq(self.headers.get("Last-Event-ID"))
+            if last_seq is None:
+                last_seq, frame = broadcaster.initial()
+                self.wfile.write(frame)
+            while True:
+                frames = broadcaster.wait(last_seq)
+                if not frames:
+                    self.wfile.write(b": keepalive\n\n")
+                for last_seq, frame in frames:
+                    self.wfile.write(frame)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def metrics(self):
+        body = Metrics.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send(self, status, body, etag, max_age, retry_after=None):
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        if retry_after:
+            self.send_header("Retry-After", str(retry_after))
+        self.send_header("Cache-Control", f"public, max-age={max_age}")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if status != 304:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(poller, host="0.0.0.0", port=8502, background=True):
+    """Starts the API server for poller; returns the server instance."""
+    handler = type("BoundPriceAPIHandler", (PriceAPIHandler,), {
+        "api": PriceAPI(poller),
+        "broadcaster": PriceBroadcaster(poller),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, name="price-api", daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+def random_walk_fetcher(seed=None, start=64000.0):
+    """Local stand-in for the upstream fetch: a new GTA announcement per call."""
+    rng = random.Random(seed)
+    state = {"price": start, "round": 0}
+
+    def fetch():
+        state["price"] += rng.choice([-100, -50, 0, 50, 100])
+        state["round"] += 1
+        sell = state["price"]
+        prices = {
+            "bullion_sell": sell, "bullion_buy": sell - 100,
+            "ornament_sell": sell + 800, "tax_base": round((sell - 100) * 0.9802, 2),
+            "update_time": f"stub {time.strftime('%H:%M:%S')} (#{state['round']})",
+            "stale": False,
+        }
+        buy = round(rng.choice([4.55, 4.60, 4.60, 4.65]), 2)
+        rates = {"buy": buy, "sell": round(buy + 0.20, 2), "base_ref": buy, "is_calibrated": True, "stale": False}
+        return {"prices": prices, "rates": rates, "missing": []}
+    return fetch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thai Gold Live JSON API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--stub", action="store_true", help="use a local random-walk source instead of GTA")
+    parser.add_argument("--interval", type=float, help="poll interval in seconds")
+    args = parser.parse_args()
+    if args.stub:
+        poller = PricePoller(interval=args.interval or 5, fetcher=random_walk_fetcher(), record_history=False)
+    else:
+        poller = PricePoller(interval=args.interval)
+        AlertManager().attach(poller) # Persisted alerts keep firing without the Streamlit app
+    print(f"Serving price API on http://{args.host}:{args.port}/api/prices")
+    serve(poller.start(), args.host, args.port, background=False)
+
+
+if __name__ == "__main__":
+    main()
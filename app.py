@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-from utils import ThaiGoldScraper, GoldConverter, RateManager
+from utils import GoldConverter, RateManager, PricePoller, DataManager, PortfolioEngine, AlertManager, Metrics, AssetCache, IndicatorEngine
 import time
 import os
 
@@ -16,6 +16,9 @@ st.set_page_config(
     }
 )
 
+# Per-section render timings, shown in the admin panel and on /metrics
+lap = Metrics.stopwatch("app")
+
 # --- ADMIN CALIBRATION ---
 try:
     # Compatible with newer Streamlit versions
@@ -25,24 +28,34 @@ try:
     if admin_code == "1a":
         with st.expander("🔧 Calibrate Exchange Rate (Admin)", expanded=True):
             st.warning("⚠️ Manual Calibration Mode")
-            current_rates = RateManager.get_final_rates()
-            base_rate = current_rates.get('base_ref', 0)
-            st.write(f"**Base Rate (Open API):** `{base_rate:.4f}`")
+            cal_currency = st.selectbox("Currency", RateManager.CURRENCIES)
+            current_rates = RateManager.get_currency_rates([cal_currency]).loc[cal_currency]
+            base_rate = current_rates['base']
+            st.write(f"**Base Rate (Open API):** `{base_rate:.4f}` THB / {cal_currency}")
             
             # Input for Real SuperRich Price
             # We use the current calibrated 'buy' as default
-            new_val = st.number_input("Enter Real SuperRich CNY Buying Price:", 
+            small = base_rate < 1 # e.g. JPY: quoted to 4 decimals
+            new_val = st.number_input(f"Enter Real SuperRich {cal_currency} Buying Price:", 
                                      value=float(current_rates['buy']), 
-                                     step=0.01,
-                                     format="%.2f")
+                                     step=0.0001 if small else 0.01,
+                                     format="%.4f" if small else "%.2f")
             
             if st.button("💾 Save Calibration"):
-                offset = RateManager.save_offset(new_val)
+                offset = RateManager.save_offset(new_val, cal_currency)
                 st.toast(f"Calibrated! Offset: {offset:.4f}", icon="✅")
                 time.sleep(1)
                 st.rerun()
+
+        with st.expander("📈 Metrics (Admin)"):
+            metrics = Metrics.summary()
+            if metrics["stages"]:
+                st.dataframe(pd.DataFrame(metrics["stages"]).T.round(2), use_container_width=True)
+            if metrics["counters"]:
+                st.dataframe(pd.Series(metrics["counters"], name="count"), use_container_width=True)
 except Exception as e:
     st.error(f"Admin Error: {e}")
+lap("admin")
 
 # Localization
 LANGS = {
@@ -76,6 +89,12 @@ LANGS = {
         "annual_return": "อัตราผลตอบแทนต่อปี",
         "calc_settings": "ตั้งค่าการคำนวณ",
         "gold_type": "ประเภททอง",
+        "price_trend": "แนวโน้มราคา",
+        "moving_avg": "ค่าเฉลี่ยเคลื่อนที่",
+        "volatility": "ความผันผวน",
+        "drawdown": "ลดลงจากจุดสูงสุด",
+        "spread": "ส่วนต่างทองรูปพรรณ",
+        "delayed": "ข้อมูลล่าช้า",
         "alerts": "แจ้งเตือนราคา",
         "alert_target": "เป้าหมายราคาทองคำแท่ง",
         "alert_cond": "เงื่อนไข",
@@ -121,6 +140,12 @@ LANGS = {
         "annual_return": "年化收益率",
         "calc_settings": "计算设置",
         "gold_type": "黄金类型",
+        "price_trend": "价格走势",
+        "moving_avg": "均线",
+        "volatility": "波动率",
+        "drawdown": "回撤",
+        "spread": "金饰溢价",
+        "delayed": "数据延迟",
         "alerts": "价格预警",
         "alert_target": "目标金条价格",
         "alert_cond": "触发条件",
@@ -166,6 +191,12 @@ LANGS = {
         "annual_return": "Annual ROI",
         "calc_settings": "Calculator Settings",
         "gold_type": "Gold Type",
+        "price_trend": "Price Trend",
+        "moving_avg": "MA",
+        "volatility": "Volatility",
+        "drawdown": "Drawdown",
+        "spread": "Ornament Spread",
+        "delayed": "Delayed",
         "alerts": "Price Alerts",
         "alert_target": "Target Bullion Price",
         "alert_cond": "Condition",
@@ -187,22 +218,24 @@ LANGS = {
 if "lang_choice" not in st.session_state:
     st.session_state.lang_choice = "CN"
 
+def set_lang(code):
+    # Runs before the rerun the click triggers, so no extra st.rerun() is needed
+    st.session_state.lang_choice = code
+
 c_l, lc1, lc2, lc3 = st.columns([2, 1, 1, 1])
 with lc1:
-    if st.button("🇨🇳 中文", use_container_width=True, type="primary" if st.session_state.lang_choice == "CN" else "secondary"):
-        st.session_state.lang_choice = "CN"
-        st.rerun()
+    st.button("🇨🇳 中文", use_container_width=True, type="primary" if st.session_state.lang_choice == "CN" else "secondary",
+              on_click=set_lang, args=("CN",))
 with lc2:
-    if st.button("🇹🇭 ไทย", use_container_width=True, type="primary" if st.session_state.lang_choice == "TH" else "secondary"):
-        st.session_state.lang_choice = "TH"
-        st.rerun()
+    st.button("🇹🇭 ไทย", use_container_width=True, type="primary" if st.session_state.lang_choice == "TH" else "secondary",
+              on_click=set_lang, args=("TH",))
 with lc3:
-    if st.button("🇺🇸 EN", use_container_width=True, type="primary" if st.session_state.lang_choice == "EN" else "secondary"):
-        st.session_state.lang_choice = "EN"
-        st.rerun()
+    st.button("🇺🇸 EN", use_container_width=True, type="primary" if st.session_state.lang_choice == "EN" else "secondary",
+              on_click=set_lang, args=("EN",))
 
 lang_code = st.session_state.lang_choice
 t = LANGS[lang_code]
+lap("language")
 
 # --- 0. MAIN HEADER (Dashboard) ---
 st.markdown(f"""
@@ -213,21 +246,35 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # --- 1. EXCHANGE RATES - TOP BAR ---
-@st.cache_data(ttl=600)
-def fetch_ex_rates():
-    return ThaiGoldScraper.get_superrich_rates()
-
-ex_rates = fetch_ex_rates()
+@st.cache_resource
+def get_alert_manager():
+    # Shared by all sessions; ticks come from the poller (see get_price_poller), not from page reruns
+    return AlertManager()
 
-@st.cache_data(ttl=300)
-def fetch_gold_data():
-    data = ThaiGoldScraper.get_latest_prices()
-    if data:
-        from utils import DataManager
-        DataManager.save_snapshot(data)
-    return data
+@st.cache_resource
+def get_price_poller():
+    # One poller per server process, shared by every session; alerts fire from it from the first tick
+    poller = PricePoller()
+    get_alert_manager().attach(poller)
+    return poller.start()
 
-prices = fetch_gold_data()
+@st.cache_resource
+def start_price_api():
+    # Optional JSON API sharing this process's poller (GOLD_API_PORT=8502)
+    port = os.environ.get("GOLD_API_PORT")
+    if port:
+        import api
+        return api.serve(get_price_poller(), port=int(port))
+
+def page_data():
+    # Shared data context for the page and its fragments: the poller's latest immutable snapshot
+    snapshot = get_price_poller().snapshot(timeout=15)
+    prices = snapshot['prices'] if snapshot else None
+    ex_rates = (snapshot and snapshot['rates']) or RateManager.get_final_rates()
+    return prices, ex_rates
+
+start_price_api()
+prices, ex_rates = page_data()
 
 st.subheader(f"🌍 {t['exchange_rates']}")
 rate_col1, rate_col2, rate_col3 = st.columns(3)
@@ -240,15 +287,28 @@ with rate_col2:
     val = prices['bullion_sell'] if prices else 0
     st.metric(f"{t['bullion']}({t['sell']})", f"{val:,.0f}")
 with rate_col3:
-    # THB/USD cleaned up
-    st.metric(t['thb_usd'], "34.50")
+    # THB per USD from the same rate table as RMB/THB
+    usd = ex_rates.get('currencies', {}).get('USD')
+    st.metric(t['thb_usd'], f"{usd['buy']:.2f}" if usd else "-")
+if ex_rates.get('stale'):
+    st.caption(f"⚠️ {t['delayed']}: {t['rmb_thb']} ({ex_rates.get('as_of') or '-'})")
+lap("rates")
 
 st.divider()
 
+# Sections below are fragments: their widgets rerun only their own section,
+# not the whole page. Each one times itself (app.<section> on /metrics).
+
 # --- 2. REAL-TIME PRICES & INTEGRATED CALCULATOR ---
-st.subheader(f"📊 {t['bullion']} & {t['ornament']}")
+@st.fragment
+@Metrics.timed("app.prices")
+def price_board(t):
+    st.subheader(f"📊 {t['bullion']} & {t['ornament']}")
+    prices, ex_rates = page_data()
+    if not prices:
+        st.error("Failed to fetch prices.")
+        return
 
-if prices:
     col1, col2 = st.columns(2)
     
     with col1:
@@ -275,85 +335,132 @@ if prices:
         o_total = (o_weight * prices['ornament_sell']) + o_gamnuy
         st.write(f"👉 **{o_total:,.2f} THB**")
     
+    currencies = ex_rates.get('currencies') or {}
+    foreign = [f"{prices['bullion_sell'] / currencies[c]['buy']:,.0f} {c}" for c in ("CNY", "USD") if c in currencies]
+    if foreign:
+        st.caption(f"💱 {t['bullion']} ({t['sell']}) ≈ " + " · ".join(foreign))
     st.caption(f"🕒 {t['last_update']}: {prices['update_time']}")
-else:
-    st.error("Failed to fetch prices.")
+    if prices.get('stale'):
+        st.warning(f"⚠️ {t['delayed']} ({t['last_update']}: {prices.get('as_of')})")
+
+price_board(t)
+
+# --- 2.5 PRICE TREND ---
+st.divider()
+
+@st.cache_data(ttl=60)
+def fetch_trend(period):
+    # Long periods come back as hourly/daily/weekly candles, never raw ticks
+    return DataManager.indicator_series(period)
+
+@st.cache_data(ttl=60)
+def fetch_indicators():
+    # Incremental: only snapshots stored since the last call are folded in
+    return DataManager.indicators()
+
+@st.fragment
+@Metrics.timed("app.trend")
+def trend_chart(t):
+    st.subheader(f"📉 {t['price_trend']}")
+    period = st.radio(t['price_trend'], ["1W", "1M", "1Y", "3Y", "All"], horizontal=True, key="trend_period", label_visibility="collapsed")
+    trend_level, trend_df = fetch_trend(period)
+    if not trend_df.empty:
+        chart_df = trend_df.set_index('timestamp')[['bullion_sell', 'ornament_sell', 'ma_short', 'ma_long']]
+        chart_df.columns = [f"{t['bullion']} ({t['sell']})", f"{t['ornament']} ({t['sell']})",
+                            f"{t['moving_avg']} {IndicatorEngine.SHORT}", f"{t['moving_avg']} {IndicatorEngine.LONG}"]
+        st.line_chart(chart_df)
+
+    ind = fetch_indicators()
+    if ind['count']:
+        i_col1, i_col2, i_col3, i_col4 = st.columns(4)
+        i_col1.metric(f"{t['moving_avg']} {IndicatorEngine.SHORT}", f"{ind['ma_short']:,.0f}")
+        i_col2.metric(t['volatility'], f"{ind['volatility']:.2f}%" if ind['volatility'] is not None else "-")
+        i_col3.metric(t['drawdown'], f"{ind['drawdown']:.2f}%")
+        i_col4.metric(t['spread'], f"{ind['spread']:,.0f}" if ind['spread'] is not None else "-")
+
+trend_chart(t)
 
 # --- 3. GOLD INVESTMENT CALCULATOR (P&L) ---
 st.divider()
-st.subheader(f"📈 {t['investment_calc']}")
-
-st.markdown(f"**💼 {t['calc_settings']}**")
-inv_col1, inv_col2, inv_col3, inv_col4 = st.columns(4)
-with inv_col1:
-    inv_type = st.radio(t['gold_type'], [t['bullion'], t['ornament']], horizontal=True, key="inv_type")
-with inv_col2:
-    buy_date = st.date_input(t['buy_date'], value=pd.to_datetime("today") - pd.Timedelta(days=30))
-with inv_col3:
-    buy_price = st.number_input(t['buy_price'], min_value=0.0, value=64000.0, step=100.0)
-with inv_col4:
-    buy_amount = st.number_input(t['buy_amount'], min_value=0.0, value=1.0, step=1.0)
-
-if prices:
-    current_price = prices['bullion_sell'] if inv_type == t['bullion'] else prices['ornament_sell']
-    total_cost = buy_price * buy_amount
-    current_val = current_price * buy_amount
-    pnl = current_val - total_cost
-    roi = (pnl / total_cost * 100) if total_cost > 0 else 0
-    
-    # Calculate Annualized ROI
-    today = pd.to_datetime("today").normalize()
-    b_date = pd.to_datetime(buy_date).normalize()
-    days_diff = (today - b_date).days
-    if days_diff <= 0: days_diff = 1
-    annual_roi = ((1 + roi/100)**(365/days_diff) - 1) * 100
-    
-    res_col1, res_col2, res_col3, res_col4 = st.columns(4)
-    res_col1.metric(t['current_value'], f"{current_val:,.0f} THB")
-    res_col2.metric(t['profit_loss'], f"{pnl:,.0f} THB", delta=f"{pnl:,.0f}")
-    res_col3.metric(t['return_rate'], f"{roi:.2f}%", delta=f"{roi:.2f}%")
-    res_col4.metric(t['annual_return'], f"{annual_roi:.2f}%")
+
+@st.fragment
+@Metrics.timed("app.pnl")
+def pnl_calculator(t):
+    st.subheader(f"📈 {t['investment_calc']}")
+
+    st.markdown(f"**💼 {t['calc_settings']}**")
+    inv_col1, inv_col2, inv_col3, inv_col4 = st.columns(4)
+    with inv_col1:
+        inv_type = st.radio(t['gold_type'], [t['bullion'], t['ornament']], horizontal=True, key="inv_type")
+    with inv_col2:
+        buy_date = st.date_input(t['buy_date'], value=pd.to_datetime("today") - pd.Timedelta(days=30))
+    with inv_col3:
+        buy_price = st.number_input(t['buy_price'], min_value=0.0, value=64000.0, step=100.0)
+    with inv_col4:
+        buy_amount = st.number_input(t['buy_amount'], min_value=0.0, value=1.0, step=1.0)
+
+    prices, _ = page_data()
+    if prices:
+        lot = pd.DataFrame([{
+            "type": "bullion" if inv_type == t['bullion'] else "ornament",
+            "buy_date": buy_date,
+            "buy_price": buy_price,
+            "amount": buy_amount,
+        }])
+        _, totals = PortfolioEngine.evaluate(lot, prices)
+        current_val, pnl = totals['current_value'], totals['pnl']
+        roi, annual_roi = totals['roi'], totals['annual_roi']
+        
+        res_col1, res_col2, res_col3, res_col4 = st.columns(4)
+        res_col1.metric(t['current_value'], f"{current_val:,.0f} THB")
+        res_col2.metric(t['profit_loss'], f"{pnl:,.0f} THB", delta=f"{pnl:,.0f}")
+        res_col3.metric(t['return_rate'], f"{roi:.2f}%", delta=f"{roi:.2f}%")
+        res_col4.metric(t['annual_return'], f"{annual_roi:.2f}%")
+
+pnl_calculator(t)
 
 # --- 3.5 [NEW] PRICE ALERTS ---
 st.divider()
-st.subheader(f"🔔 {t['alerts']}")
 
-@st.cache_resource
-def get_alert_manager():
-    from utils import AlertManager
-    return AlertManager()
+@st.fragment
+@Metrics.timed("app.alerts")
+def price_alerts(t):
+    st.subheader(f"🔔 {t['alerts']}")
+    alert_manager = get_alert_manager()
+    ALERT_CONDITIONS = {"ABOVE": t['alert_above'], "BELOW": t['alert_below']}
+
+    alerts_col1, alerts_col2, alerts_col3 = st.columns([2, 1, 1])
+    with alerts_col1:
+        target_price = st.number_input(t['alert_target'], min_value=0, value=65000, step=100)
+    with alerts_col2:
+        condition = st.selectbox(t['alert_cond'], list(ALERT_CONDITIONS), format_func=ALERT_CONDITIONS.get)
+    with alerts_col3:
+        if st.button(t['alert_set'], use_container_width=True):
+            if "active_alert" in st.session_state:
+                alert_manager.remove(st.session_state.active_alert)
+            st.session_state.active_alert = alert_manager.add(target_price, condition)
+            st.session_state.pop("alert_notified", None)
+            st.success(t['set_confirm'])
+
+    alert = alert_manager.status(st.session_state.get("active_alert"))
+    if alert:
+        prices, _ = page_data()
+        current = prices['bullion_sell'] if prices else 0
+        cond_label = ALERT_CONDITIONS[alert['condition']]
+        
+        if alert['fired_at']:
+            fired = alert['fired_price']
+            if st.session_state.get("alert_notified") != alert['id']:
+                st.toast(f"{t['alert_reached']} {fired:,.0f} {cond_label} {alert['target']:,.0f}", icon="🔥")
+                st.session_state.alert_notified = alert['id']
+            st.error(f"{t['alert_reached']}: {fired:,.0f} {cond_label} {alert['target']:,.0f} ({alert['fired_at']})")
+        else:
+            st.info(f"{t['alert_monitoring']}: {t['bullion']} {current:,.0f} vs {t['alert_target']} {alert['target']:,.0f}")
 
-alerts_col1, alerts_col2, alerts_col3 = st.columns([2, 1, 1])
-with alerts_col1:
-    target_price = st.number_input(t['alert_target'], min_value=0, value=65000, step=100)
-with alerts_col2:
-    condition = st.selectbox(t['alert_cond'], [t['alert_above'], t['alert_below']])
-with alerts_col3:
-    if st.button(t['alert_set'], use_container_width=True):
-        st.session_state.active_alert = {"target": target_price, "cond": condition}
-        st.success(t['set_confirm'])
-
-if "active_alert" in st.session_state:
-    alert = st.session_state.active_alert
-    current = prices['bullion_sell'] if prices else 0
-    triggered = False
-    if alert['cond'] == t['alert_above'] and current >= alert['target']: triggered = True
-    if alert['cond'] == t['alert_below'] and current <= alert['target']: triggered = True
-    
-    if triggered:
-        st.toast(f"{t['alert_reached']} {current:,.0f} {alert['cond']} {alert['target']:,.0f}", icon="🔥")
-        st.error(f"{t['alert_reached']}: {current:,.0f} {alert['cond']} {alert['target']:,.0f}")
-    else:
-        st.info(f"{t['alert_monitoring']}: {t['bullion']} {current:,.0f} vs {t['alert_target']} {alert['target']:,.0f}")
+price_alerts(t)
 
 # --- 4. UNIT CONVERTER (Weight Only) ---
 st.divider()
-st.subheader(f"⚖️ {t['unit_converter']}")
-
-u_col1, u_col2, u_col3 = st.columns(3)
-
-# Session state to handle mutual updates
-if 'u_baht' not in st.session_state: st.session_state.u_baht = 1.0
 
 def update_from_baht():
     b = st.session_state.u_baht
@@ -370,15 +477,27 @@ def update_from_oz():
     st.session_state.u_gram = oz * 31.1035
     st.session_state.u_baht = st.session_state.u_gram / 15.244
 
-# Initialize others
-if 'u_gram' not in st.session_state: update_from_baht()
+@st.fragment
+@Metrics.timed("app.converter")
+def unit_converter(t):
+    st.subheader(f"⚖️ {t['unit_converter']}")
+
+    u_col1, u_col2, u_col3 = st.columns(3)
+
+    # Session state to handle mutual updates
+    if 'u_baht' not in st.session_state: st.session_state.u_baht = 1.0
+    # Initialize others
+    if 'u_gram' not in st.session_state: update_from_baht()
+
+    with u_col1:
+        st.number_input(t['baht'], key="u_baht", on_change=update_from_baht, step=0.1)
+    with u_col2:
+        st.number_input(t['gram'], key="u_gram", on_change=update_from_gram, step=1.0)
+    with u_col3:
+        st.number_input(t['ounce'], key="u_oz", on_change=update_from_oz, step=0.1)
 
-with u_col1:
-    st.number_input(t['baht'], key="u_baht", on_change=update_from_baht, step=0.1)
-with u_col2:
-    st.number_input(t['gram'], key="u_gram", on_change=update_from_gram, step=1.0)
-with u_col3:
-    st.number_input(t['ounce'], key="u_oz", on_change=update_from_oz, step=0.1)
+unit_converter(t)
+lap(None)
 
 # --- 5. SPONSOR MODULE ---
 st.divider()
@@ -392,18 +511,16 @@ st.markdown(f"""
 s_col1, s_col2 = st.columns(2)
 with s_col1:
     st.write(f"💳 **{t['sponsor_alipay']}**")
-    if os.path.exists("qr_alipay.jpg"):
-        st.image("qr_alipay.jpg", width=200)
-    else:
-        st.image("https://via.placeholder.com/200?text=Alipay+QR", width=200)
+    # Resized and re-encoded once per process (~19 KB instead of the 500 KB original)
+    qr = AssetCache.image("qr_alipay.jpg", width=200)
+    st.image(qr or "https://via.placeholder.com/200?text=Alipay+QR", width=200)
 with s_col2:
     st.write(f"📲 **{t['sponsor_promptpay']}**")
-    if os.path.exists("qr_promptpay.jpg"):
-        st.image("qr_promptpay.jpg", width=200)
-    else:
-        st.image("https://via.placeholder.com/200?text=PromptPay+QR", width=200)
+    qr = AssetCache.image("qr_promptpay.jpg", width=200)
+    st.image(qr or "https://via.placeholder.com/200?text=PromptPay+QR", width=200)
 
 st.markdown(f"<div style='text-align: center; color: #bbb; font-size: 0.8em;'>{t['sponsor_msg']}</div>", unsafe_allow_html=True)
+lap("sponsor")
 
 # --- 6. FOOTER ---
 st.divider()
@@ -413,3 +530,4 @@ st.markdown(f"""
     <p>© 2025 Thai Gold Live - Your Premium Gold Companion</p>
 </div>
 """, unsafe_allow_html=True)
+lap("footer")
@@ -0,0 +1,922 @@
+"""
+Offline benchmarks for Thai Gold Live.
+
+Usage:
+    python bench.py parse [--fixtures DIR] [--repeat 50]
+    python bench.py history [--rows 1000000]
+    python bench.py filter [--rows 10000000]
+    python bench.py quote [--items 10000]
+    python bench.py api [--clients 16] [--seconds 5] [--url http://host:8502/api/prices]
+    python bench.py stream [--clients 500] [--ticks 10]
+    python bench.py fetch [--delays 0 0.2 1.0]
+    python bench.py render
+    python bench.py interact
+    python bench.py stress [--procs 4] [--threads 4] [--seconds 5]
+    python bench.py backfill [--pages 5000] [--workers N] [--gzip]
+    python bench.py replay [--csv gold_history.csv] [--speedup 1000] [--sessions 50] [--viewers 20]
+    python bench.py suite [--out bench_results.json] [--history-sizes 10000 1000000 10000000]
+    python bench.py compare old.json new.json
+
+`suite` runs offline: GTA pages come from fixtures/gta and open.er-api is
+replaced by a local stub server (StubUpstream). The full default suite
+writes 10M-row history stores and takes a while; pass smaller sizes for a
+quick check.
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import PricePoller, GoldConverter, GTAParser, CSVHistoryStore, SQLiteHistoryStore, DataManager, index_by_time, PRICE_COLUMNS
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "gta")
+
+
+def time_call(fn, repeat):
+    """Returns the best and mean wall time (ms) of fn over repeat runs."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return min(samples), sum(samples) / len(samples)
+
+
+def percentiles(samples, points):
+    """Nearest-rank percentiles of samples for each p in points."""
+    ordered = sorted(samples)
+    if not ordered:
+        return [0.0 for _ in points]
+    return [ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] for p in points]
+
+
+def bench_parse(args):
+    """Compares GTA parse engines on saved homepage fixtures."""
+    pages = sorted(glob.glob(os.path.join(args.fixtures, "*.html")))
+    if not pages:
+        print(f"No fixtures found in {args.fixtures}")
+        return {}
+    results = {}
+    for path in pages:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        print(f"{os.path.basename(path)} ({len(html.encode()) / 1024:.0f} KB)")
+        page = results[os.path.basename(path)] = {}
+        baseline = None
+        for engine in GTAParser.ENGINES:
+            parse = getattr(GTAParser, f"parse_{engine}")
+            try:
+                parse(html)
+            except ImportError:
+                print(f"  {engine:<6} skipped (not installed)")
+                continue
+            best, mean = time_call(lambda: parse(html), args.repeat)
+            page[f"{engine}_ms"] = mean
+            if engine == "soup":
+                baseline = mean
+            print(f"  {engine:<6} best {best:8.3f} ms  mean {mean:8.3f} ms")
+        best, mean = time_call(lambda: GTAParser.parse(html), args.repeat)
+        page["parse_ms"] = mean
+        if baseline:
+            print(f"  parse()  mean {mean:8.3f} ms  ({baseline / mean:.1f}x faster than soup)")
+    return results
+
+
+def synthetic_history(rows, years=4, seed=0):
+    """Random-walk price history of `rows` snapshots ending now."""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now().floor("s")
+    step = pd.Timedelta(days=365 * years) / rows
+    bullion_sell = 40000 + np.cumsum(rng.normal(0, 20, rows)).round(-1)
+    return pd.DataFrame({
+        "bullion_sell": bullion_sell,
+        "bullion_buy": bullion_sell - 100,
+        "ornament_sell": bullion_sell + 800,
+        "tax_base": (bullion_sell - 100) * 0.98,
+        "update_time": [f"#{i}" for i in range(rows)],
+        "timestamp": end - step * np.arange(rows)[::-1],
+    })
+
+
+def bench_history(args):
+    """Full loads vs period range queries on each history backend."""
+    df = synthetic_history(args.rows)
+    periods = list(DataManager.PERIOD_DAYS) + ["All"]
+    now = pd.Timestamp.now()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {
+            "csv": CSVHistoryStore(os.path.join(tmp, "history.csv")),
+            "sqlite": SQLiteHistoryStore(os.path.join(tmp, "history.db")),
+        }
+        for name, store in stores.items():
+            start = time.perf_counter()
+            store.replace(df)
+            elapsed = time.perf_counter() - start
+            results[name] = {"write_s": elapsed}
+            print(f"{name:<7} write {args.rows:,} rows: {elapsed:7.2f} s")
+            for period in periods:
+                days = DataManager.PERIOD_DAYS.get(period)
+                since = now - pd.Timedelta(days=days) if days else None
+                best, mean = time_call(lambda: store.load(start=since), args.repeat)
+                n = len(store.load(start=since))
+                results[name][f"load_{period}_ms"] = mean
+                print(f"  {period:<4} {n:>10,} rows  mean {mean:9.1f} ms")
+        ok = check_csv_rewrite(os.path.join(tmp, "rewrite.csv"), df.head(1000))
+        results["csv"]["rewrite_ok"] = ok
+        print(f"csv     reload after in-place rewrite: {'OK' if ok else 'FAILED'}")
+    return results
+
+
+def check_csv_rewrite(path, df):
+    """
+    Rewrites a CSV history in place (same inode) under a warm incremental
+    cache, both at the same size and grown, and checks the next load matches
+    a fresh parse. Returns True if both do.
+    """
+    store = CSVHistoryStore(path)
+    ok = True
+    for extra in (0, 100):
+        store.replace(df)
+        store.load() # Warm the cache
+        changed = synthetic_history(len(df) + extra, seed=extra + 1)
+        changed["update_time"] = df["update_time"].iloc[0] # Same width: the same-size case keeps the size
+        with open(path, "r+b") as f:
+            body = changed.assign(timestamp=changed["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")).to_csv(index=False)
+            f.write(body.encode("utf-8"))
+            f.truncate()
+        got = store.load().reset_index(drop=True)
+        expected = CSVHistoryStore(path).load().reset_index(drop=True)
+        ok = ok and got[PRICE_COLUMNS].equals(expected[PRICE_COLUMNS]) and len(got) == len(changed)
+    return ok
+
+
+def bench_filter(args):
+    """Boolean-mask period filter vs searchsorted slicing on an in-memory frame."""
+    rows = args.rows
+    end = pd.Timestamp.now().floor("s")
+    step = pd.Timedelta(days=365 * 4) / rows
+    df = pd.DataFrame({
+        "bullion_sell": np.full(rows, 40000.0),
+        "timestamp": end - step * np.arange(rows)[::-1],
+    })
+    df = index_by_time(df)
+    now = pd.Timestamp.now()
+    print(f"{rows:,} rows")
+    results = {}
+    for period, days in DataManager.PERIOD_DAYS.items():
+        since = now - pd.Timedelta(days=days)
+        _, mask_ms = time_call(lambda: df[df["timestamp"] > since], args.repeat)
+        _, slice_ms = time_call(lambda: DataManager.filter_history(df, period), args.repeat)
+        results[period] = {"mask_ms": mask_ms, "filter_ms": slice_ms}
+        print(f"  {period:<3} mask {mask_ms:8.2f} ms  searchsorted {slice_ms:8.3f} ms")
+    return results
+
+
+def bench_quote(args):
+    """Scalar per-SKU loop vs GoldConverter.quote_catalogue."""
+    rng = np.random.default_rng(0)
+    items = pd.DataFrame({
+        "sku": [f"SKU{i:06d}" for i in range(args.items)],
+        "weight_baht": rng.choice([0.25, 0.5, 1, 2, 5], args.items),
+        "gamnuy": rng.integers(300, 2500, args.items),
+        "type": rng.choice(["ornament", "bullion"], args.items, p=[0.9, 0.1]),
+    })
+    prices = {"bullion_sell": 64350.0, "ornament_sell": 65150.0}
+    rate = 4.60
+
+    def scalar():
+        rows = []
+        for item in items.itertuples(index=False):
+            is_ornament = item.type != "bullion"
+            price = prices["ornament_sell"] if is_ornament else prices["bullion_sell"]
+            total = GoldConverter.calculate_ornament_total(price, item.weight_baht, item.gamnuy)
+            rows.append((GoldConverter.baht_to_gram(item.weight_baht, is_ornament), total, total / rate))
+        return rows
+
+    _, scalar_ms = time_call(scalar, args.repeat)
+    _, batch_ms = time_call(lambda: GoldConverter.quote_catalogue(items, prices, rate), args.repeat)
+    print(f"{args.items:,} items  scalar {scalar_ms:8.2f} ms  batch {batch_ms:8.2f} ms "
+          f"({scalar_ms / batch_ms:.0f}x)")
+    return {"scalar_ms": scalar_ms, "batch_ms": batch_ms}
+
+
+def stub_fetcher(html_path=os.path.join(FIXTURES_DIR, "homepage.html")):
+    """Upstream stand-in for PricePoller: fixture prices and a fixed rate."""
+    with open(html_path, encoding="utf-8") as f:
+        prices = GTAParser.parse(f.read())
+    rates = {"buy": 4.60, "sell": 4.80, "base_ref": 4.6123, "is_calibrated": True, "stale": False}
+    return lambda: {"prices": dict(prices, stale=False), "rates": rates, "missing": []}
+
+
+def bench_api(args):
+    """Requests/sec against the JSON API (local stub server unless --url)."""
+    import threading
+    import urllib.request
+
+    url = args.url
+    if not url:
+        import api
+        poller = PricePoller(fetcher=stub_fetcher(), record_history=False)
+        poller.refresh()
+        server = api.serve(poller, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/prices"
+
+    counts, latencies = [], []
+    deadline = time.perf_counter() + args.seconds
+
+    def client():
+        import http.client
+        parsed = urllib.request.urlparse(url)
+        conn = http.client.HTTPConnection(parsed.hostname, parsed.port)
+        etag, n, lat = None, 0, []
+        while time.perf_counter() < deadline:
+            headers = {"If-None-Match": etag} if etag and args.conditional else {}
+            start = time.perf_counter()
+            conn.request("GET", parsed.path + (f"?{parsed.query}" if parsed.query else ""), headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            lat.append((time.perf_counter() - start) * 1000)
+            etag = resp.getheader("ETag")
+            n += 1
+        counts.append(n)
+        latencies.extend(lat)
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    total = sum(counts)
+    p50, p95, p99 = percentiles(latencies, (50, 95, 99))
+    print(f"{url}  clients={args.clients} conditional={args.conditional}")
+    print(f"  {total / args.seconds:,.0f} req/s  p50 {p50:.2f} ms  p95 {p95:.2f} ms  p99 {p99:.2f} ms")
+    return {"req_per_s": total / args.seconds, "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+
+def bench_stream(args):
+    """Fan-out latency of one price tick to many idle SSE viewers (stub source)."""
+    import http.client
+    import threading
+    import api
+
+    poller = PricePoller(fetcher=api.random_walk_fetcher(seed=0), record_history=False)
+    poller.refresh()
+    server = api.serve(poller, "127.0.0.1", 0)
+    port = server.server_address[1]
+    received = {}
+    lock = threading.Lock()
+    ready = threading.Barrier(args.clients + 1)
+
+    def viewer():
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        conn.request("GET", "/api/stream")
+        resp = conn.getresponse()
+        resp.fp.readline() # first line of the snapshot event
+        ready.wait()
+        for line in resp.fp:
+            if line.startswith(b"id: "):
+                seq = int(line[4:].rsplit(b"-", 1)[1]) # id: <run>-<seq>
+                with lock:
+                    received.setdefault(seq, []).append(time.perf_counter())
+                if seq > args.ticks:
+                    break
+        conn.close()
+
+    threads = [threading.Thread(target=viewer, daemon=True) for _ in range(args.clients)]
+    for th in threads:
+        th.start()
+    ready.wait()
+    # Viewers joined at seq 1; every stub fetch is a new announcement, so tick i is seq i + 2
+    sent = {}
+    for i in range(args.ticks):
+        sent[i + 2] = time.perf_counter()
+        poller.refresh()
+        time.sleep(0.2)
+    poller.refresh()
+    for th in threads:
+        th.join(timeout=10)
+
+    spreads = [max(received[s]) - t0 for s, t0 in sent.items() if len(received.get(s, [])) == args.clients]
+    spreads.sort()
+    print(f"{args.clients} viewers, {len(spreads)}/{args.ticks} ticks delivered to all")
+    if spreads:
+        print(f"  last viewer received tick after p50 {spreads[len(spreads) // 2] * 1000:.1f} ms, "
+              f"max {spreads[-1] * 1000:.1f} ms")
+    return {"delivered_ticks": len(spreads), "fanout_max_ms": spreads[-1] * 1000 if spreads else None}
+
+
+class StubUpstream:
+    """
+    Local stand-in for goldtraders.or.th and open.er-api.com: replays a
+    recorded GTA page at /gta and a fixed CNY rate table at /v6/latest/CNY,
+    sleeping `delay` seconds before every response.
+    """
+    RATES = {"result": "success", "base_code": "CNY",
+             "rates": {"CNY": 1, "THB": 4.6123, "USD": 0.1405, "EUR": 0.1282, "JPY": 21.05, "HKD": 1.0952}}
+
+    def __init__(self, html_path=os.path.join(FIXTURES_DIR, "homepage.html"), delay=0.0):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        with open(html_path, "rb") as f:
+            html = f.read()
+        rates = json.dumps(StubUpstream.RATES).encode()
+        stub = self
+        self.delay = delay
+        self.hits = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                stub.hits += 1
+                time.sleep(stub.delay)
+                body, kind = (html, "text/html; charset=utf-8") if self.path.startswith("/gta") else (rates, "application/json")
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def install(self):
+        """Points the scrapers at this stub and clears every upstream cache."""
+        import utils
+        utils.ThaiGoldScraper.GTA_URL = self.base + "/gta"
+        utils.RateManager.BASE_API_URL = self.base + "/v6/latest/CNY"
+        utils.ThaiGoldScraper._last_prices = None
+        utils.RateManager.reset_cache()
+        utils.UpstreamClient._validators.clear()
+        utils.CircuitBreaker._breakers.clear()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+
+
+def bench_fetch(args):
+    """Upstream fetch latency against the stub under injected delays."""
+    from utils import PriceAggregator, RateManager, ThaiGoldScraper
+    results = {}
+    for delay in args.delays:
+        stub = StubUpstream(delay=delay).install()
+        _, gta_ms = time_call(ThaiGoldScraper.get_latest_prices, args.repeat)
+        _, rate_ms = time_call(RateManager.fetch_base_rate, args.repeat)
+        # fetch_all with a cold rate cache each time: both sources really go upstream
+        def cold_fetch_all():
+            stub.install()
+            PriceAggregator.fetch_all()
+        _, all_ms = time_call(cold_fetch_all, args.repeat)
+        stub.close()
+        results[f"delay_{delay:g}s"] = {"gta_ms": gta_ms, "rate_ms": rate_ms, "fetch_all_ms": all_ms}
+        print(f"delay {delay:4.1f}s  GTA {gta_ms:8.1f} ms  rate {rate_ms:8.1f} ms  fetch_all {all_ms:8.1f} ms")
+    return results
+
+
+def bench_render(args):
+    """Full app.py render time with Streamlit's AppTest against the stub upstream."""
+    from streamlit.testing.v1 import AppTest
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    stub = StubUpstream().install()
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            at = AppTest.from_file(app_path, default_timeout=60)
+            start = time.perf_counter()
+            at.run()
+            results["cold_ms"] = (time.perf_counter() - start) * 1000
+            if at.exception:
+                print(f"App raised: {at.exception[0].value}")
+            _, results["rerun_ms"] = time_call(at.run, args.repeat)
+        finally:
+            os.chdir(cwd)
+            stub.close()
+    print(f"render  cold {results['cold_ms']:8.1f} ms  rerun {results['rerun_ms']:8.1f} ms")
+    return results
+
+
+def bench_interact(args):
+    """
+    Server CPU per widget interaction: a whole-page rerun versus the
+    fragment that owns the widget. AppTest always reruns the full script,
+    so the fragment cost is read from its own app.<section> timer.
+    """
+    from streamlit.testing.v1 import AppTest
+    from utils import Metrics
+
+    interactions = {
+        "converter": lambda at, i: at.number_input(key="u_baht").set_value(1.0 + i),
+        "prices": lambda at, i: at.number_input(key="b_weight").set_value(1.0 + i),
+        "trend": lambda at, i: at.radio(key="trend_period").set_value(["1W", "1M", "1Y"][i % 3]),
+    }
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    stub = StubUpstream().install()
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            at = AppTest.from_file(app_path, default_timeout=60).run()
+            for section, interact in interactions.items():
+                Metrics.reset()
+                cpu = []
+                for i in range(args.repeat):
+                    interact(at, i)
+                    start = time.process_time()
+                    at.run()
+                    cpu.append((time.process_time() - start) * 1000)
+                page_ms = sum(cpu) / len(cpu)
+                fragment_ms = Metrics.summary()["stages"][f"app.{section}"]["p50"]
+                results[section] = {"page_cpu_ms": page_ms, "fragment_ms": fragment_ms}
+                print(f"{section:<10} full rerun {page_ms:8.1f} ms CPU  fragment rerun {fragment_ms:7.2f} ms "
+                      f"({page_ms / max(fragment_ms, 1e-3):.0f}x less)")
+        finally:
+            os.chdir(cwd)
+            stub.close()
+    return results
+
+
+def stress_worker(task):
+    """
+    One replica: `threads` sessions that keep saving whatever the current
+    announcement is (it changes every `tick` seconds) until `seconds` pass.
+    Returns the announcement numbers it saw and its save latencies.
+    """
+    tmp, backend, threads, t0, seconds, tick = task
+    import threading
+    os.chdir(tmp)
+    DataManager.BACKEND = backend
+    seen, latencies, lock = set(), [], threading.Lock()
+
+    def session():
+        while time.time() < t0 + seconds:
+            n = int((time.time() - t0) / tick)
+            snap = {"bullion_sell": 60000.0 + n, "bullion_buy": 59900.0 + n, "ornament_sell": 60800.0 + n,
+                    "tax_base": 58700.0 + n, "update_time": f"announcement {n}"}
+            start = time.perf_counter()
+            DataManager.save_snapshot(snap)
+            with lock:
+                seen.add(n)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    time.sleep(max(0.0, t0 - time.time()))
+    pool = [threading.Thread(target=session) for _ in range(threads)]
+    for th in pool:
+        th.start()
+    for th in pool:
+        th.join()
+    return seen, latencies, DataManager.get_writer().commits
+
+
+def bench_stress(args):
+    """
+    Several processes save the same stream of announcements into one store,
+    like replicas sharing a volume. Checks that every announcement is stored
+    exactly once with no torn rows, and reports save latency and how many
+    saves each group commit absorbed.
+    """
+    import multiprocessing
+    results = {}
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory() as tmp:
+            t0 = time.time() + 3 # Let every process finish importing first
+            tasks = [(tmp, backend, args.threads, t0, args.seconds, args.tick)] * args.procs
+            with multiprocessing.get_context("spawn").Pool(args.procs) as pool:
+                out = pool.map(stress_worker, tasks)
+            expected = set().union(*(seen for seen, _, _ in out))
+            latencies = [ms for _, lat, _ in out for ms in lat]
+            commits = sum(c for _, _, c in out)
+
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                if backend == "csv":
+                    # A torn or interleaved line shows up as a parse error or NaN
+                    df = pd.read_csv(DataManager.HISTORY_FILE)
+                else:
+                    df = DataManager.get_store("sqlite").load()
+            finally:
+                os.chdir(cwd)
+            stored = df["update_time"].str.replace("announcement ", "").astype(int)
+            duplicates = int(stored.duplicated().sum())
+            missing = len(expected - set(stored))
+            torn = int(df[["bullion_sell", "update_time"]].isna().any(axis=1).sum())
+            ok = duplicates == 0 and missing == 0 and torn == 0 and len(df) == len(expected)
+
+            p50, p99 = percentiles(latencies, (50, 99))
+            results[backend] = {"saves": len(latencies), "rows": len(df), "commits": commits,
+                                "p50_ms": p50, "p99_ms": p99, "ok": ok}
+            print(f"{backend:<7} {args.procs} procs x {args.threads} threads: {len(latencies):,} saves -> "
+                  f"{len(df):,} rows in {commits:,} commits  p50 {p50:.2f} ms  p99 {p99:.2f} ms")
+            print(f"        duplicates {duplicates}  missing {missing}  torn {torn}  -> {'OK' if ok else 'FAILED'}")
+    return results
+
+
+def write_archive(directory, pages, compress=False, seed=0):
+    """
+    Writes `pages` copies of the recorded GTA homepage with a new
+    announcement (date, round and prices) in each, one per 30 minutes.
+    """
+    import gzip
+    import re
+    with open(os.path.join(FIXTURES_DIR, "homepage.html"), encoding="utf-8") as f:
+        html = f.read()
+    fields = {"lblAsTime": "{update_time}", "lblBLSell": "{bl_sell:,.2f}", "lblBLBuy": "{bl_buy:,.2f}",
+              "lblOMSell": "{om_sell:,.2f}", "lblOMBuy": "{om_buy:,.2f}"}
+    template = html.replace("{", "{{").replace("}", "}}")
+    for suffix, slot in fields.items():
+        template = re.sub(rf'(id="DetailPlace_uc_goldprices1_{suffix}"[^>]*>)[^<]*', lambda m: m.group(1) + slot, template)
+
+    rng = np.random.default_rng(seed)
+    price = 30000 + np.cumsum(rng.choice([-50, 0, 50], pages))
+    when = pd.Timestamp("2018-01-01 09:00") + pd.to_timedelta(np.arange(pages) * 30, unit="min")
+    for i in range(pages):
+        ts, sell = when[i], float(price[i])
+        update_time = f"{ts.day:02d}/{ts.month:02d}/{ts.year + 543} เวลา {ts:%H:%M} น. (ครั้งที่ {i % 40 + 1})"
+        page = template.format(update_time=update_time, bl_sell=sell, bl_buy=sell - 100,
+                               om_sell=sell + 800, om_buy=round((sell - 100) * 0.9802, 2)).encode("utf-8")
+        name = os.path.join(directory, f"gta_{i:07d}.html")
+        if compress:
+            with gzip.open(name + ".gz", "wb", compresslevel=1) as f:
+                f.write(page)
+        else:
+            with open(name, "wb") as f:
+                f.write(page)
+
+
+def bench_backfill(args):
+    """End-to-end tools.py backfill over a generated archive of GTA pages."""
+    import tools
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = os.path.join(tmp, "archive")
+        os.makedirs(archive)
+        write_archive(archive, args.pages, compress=args.gzip)
+        os.chdir(tmp)
+        try:
+            DataManager._stores.clear()
+            DataManager._writers.clear()
+            DataManager._rollups = None
+            start = time.perf_counter()
+            tools.cmd_backfill(argparse.Namespace(directory=archive, workers=args.workers, chunksize=256,
+                                                  batch=5000, backend=args.backend))
+            elapsed = time.perf_counter() - start
+            rows = len(DataManager.load_history())
+        finally:
+            os.chdir(cwd)
+    print(f"{args.pages:,} pages -> {rows:,} rows in {elapsed:.1f} s ({args.pages / elapsed:,.0f} pages/s)")
+    return {"pages_per_s": args.pages / elapsed, "rows": rows}
+
+
+def replay_source(args):
+    """Rows to replay: a history CSV (e.g. gold_history.csv) or a synthetic tick stream."""
+    if args.csv:
+        df = pd.read_csv(args.csv).dropna(subset=["bullion_sell"])
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+        df = df.sort_values("timestamp", kind="stable")
+        if args.rows:
+            df = df.tail(args.rows)
+    else:
+        # GTA-like cadence: a new announcement every --step seconds
+        df = synthetic_history(args.rows)
+        df["timestamp"] = pd.Timestamp.now().floor("s") - pd.to_timedelta(np.arange(len(df))[::-1] * args.step, unit="s")
+    return df.reset_index(drop=True)
+
+
+def bench_replay(args):
+    """
+    Replays history ticks through PricePoller.refresh() - the live ingestion
+    path (history writer, rollups, alerts, API caches, SSE) - at --speedup
+    times real time, while N simulated sessions and SSE viewers use the app's
+    read paths. Reports tick throughput, upstream fan-out and latencies.
+    """
+    import http.client
+    import json
+    import random
+    import threading
+    import api
+    from utils import AlertManager, Metrics
+
+    df = replay_source(args)
+    rows = df.to_dict("records")
+    offsets = (df["timestamp"] - df["timestamp"].iloc[0]).dt.total_seconds().to_numpy()
+    # Due time of each tick in wall seconds; overnight/weekend gaps are capped
+    due = np.concatenate([[0.0], np.cumsum(np.minimum(np.diff(offsets) / args.speedup, args.max_wait))])
+
+    cwd = os.getcwd()
+    saved = (dict(DataManager._stores), dict(DataManager._writers), DataManager._rollups, DataManager._indicators)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp) # History, rollups, alerts and indicators all go to a scratch directory
+        DataManager._stores.clear()
+        DataManager._writers.clear()
+        DataManager._rollups = None
+        DataManager._indicators = None
+        Metrics.reset()
+        stop, server = threading.Event(), None
+        try:
+            cursor = {"i": 0, "upstream": 0}
+            rates = {"buy": 4.6, "sell": 4.8, "base_ref": 4.61, "is_calibrated": True, "stale": False}
+
+            def fetch():
+                # Stands in for PriceAggregator.fetch_all: one "upstream" call per tick
+                row = rows[cursor["i"]]
+                cursor["upstream"] += 1
+                prices = {k: float(row[k]) for k in PRICE_COLUMNS}
+                prices.update(update_time=str(row["update_time"]), stale=False, as_of=str(row["timestamp"]))
+                return {"prices": prices, "rates": rates, "missing": []}
+
+            poller = PricePoller(fetcher=fetch, record_history=True)
+            alerts = AlertManager().attach(poller)
+            poller.refresh()
+            server = api.serve(poller, "127.0.0.1", 0)
+            port = server.server_address[1]
+
+            lock = threading.Lock()
+            latencies = {"prices": [], "history": [], "page": []}
+            published, sse_lag = {}, []
+
+            def session(n):
+                rng = random.Random(n)
+                first = rows[0]["bullion_sell"]
+                alert_id = alerts.add(first + rng.gauss(0, 500), rng.choice(["ABOVE", "BELOW"]), subscriber=f"s{n}")
+                conn = http.client.HTTPConnection("127.0.0.1", port)
+                etag, mine = None, {k: [] for k in latencies}
+                while not stop.is_set():
+                    roll = rng.random()
+                    start = time.perf_counter()
+                    if roll < 0.2:
+                        # A Streamlit rerun: shared snapshot plus this session's alert
+                        poller.snapshot()
+                        alerts.status(alert_id)
+                        op = "page"
+                    else:
+                        op, path = ("history", "/api/history?period=1W") if roll < 0.3 else ("prices", "/api/prices")
+                        conn.request("GET", path, headers={"If-None-Match": etag} if etag and op == "prices" else {})
+                        resp = conn.getresponse()
+                        resp.read()
+                        if op == "prices":
+                            etag = resp.getheader("ETag")
+                    mine[op].append((time.perf_counter() - start) * 1000)
+                    stop.wait(rng.expovariate(1 / args.think) if args.think else 0)
+                conn.close()
+                with lock:
+                    for k, v in mine.items():
+                        latencies[k].extend(v)
+
+            def viewer():
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                conn.request("GET", "/api/stream")
+                resp = conn.getresponse()
+                try:
+                    for line in resp.fp:
+                        if stop.is_set():
+                            break
+                        if line.startswith(b"data: "):
+                            now = time.perf_counter()
+                            sent = published.get(json.loads(line[6:]).get("update_time"))
+                            if sent is not None:
+                                with lock:
+                                    sse_lag.append((now - sent) * 1000)
+                except OSError:
+                    pass
+                conn.close()
+
+            threads = [threading.Thread(target=session, args=(n,), daemon=True) for n in range(args.sessions)]
+            threads += [threading.Thread(target=viewer, daemon=True) for _ in range(args.viewers)]
+            for th in threads:
+                th.start()
+            time.sleep(0.5) # Let sessions connect and register alerts
+
+            ingest, late = [], []
+            t0 = time.perf_counter()
+            for i in range(1, len(rows)):
+                wait = t0 + due[i] - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                else:
+                    late.append(-wait * 1000)
+                cursor["i"] = i
+                published[str(rows[i]["update_time"])] = start = time.perf_counter()
+                poller.refresh()
+                ingest.append((time.perf_counter() - start) * 1000)
+            elapsed = time.perf_counter() - t0
+            time.sleep(0.5) # Let viewers drain the last frames
+            stop.set()
+            poller.refresh() # Wakes idle SSE viewers so they can exit
+            for th in threads:
+                th.join(timeout=5)
+        finally:
+            stop.set()
+            if server is not None:
+                server.shutdown()
+            os.chdir(cwd)
+            DataManager._stores.clear()
+            DataManager._stores.update(saved[0])
+            DataManager._writers.clear()
+            DataManager._writers.update(saved[1])
+            DataManager._rollups, DataManager._indicators = saved[2], saved[3]
+
+    ticks = len(rows) - 1
+    requests_total = sum(len(v) for v in latencies.values())
+    fired = sum(1 for a in alerts._alerts.values() if a["fired_at"])
+    p = lambda values: dict(zip(("p50_ms", "p95_ms", "p99_ms"), percentiles(values, (50, 95, 99))))
+    results = {
+        "ticks": ticks, "seconds": elapsed,
+        "ticks_per_s": ticks / elapsed, "target_ticks_per_s": ticks / due[-1] if due[-1] else None,
+        "late_ticks": len(late), "max_late_ms": max(late) if late else 0.0,
+        "ingest": p(ingest),
+        "upstream_requests": cursor["upstream"], "session_requests": requests_total,
+        "fanout": requests_total / max(cursor["upstream"], 1),
+        "sessions": {op: dict(p(v), count=len(v), per_s=len(v) / elapsed) for op, v in latencies.items()},
+        "sse": dict(p(sse_lag), frames=len(sse_lag), expected=ticks * args.viewers),
+        "alerts": {"registered": args.sessions, "fired": fired},
+        "save_snapshot": Metrics.summary()["stages"].get("history.save_snapshot"),
+    }
+
+    print(f"Replayed {ticks:,} ticks in {elapsed:.1f} s: {results['ticks_per_s']:,.1f} ticks/s "
+          f"(target {results['target_ticks_per_s'] or 0:,.1f}), {len(late)} late, max {results['max_late_ms']:.0f} ms behind")
+    print(f"  ingest     p50 {results['ingest']['p50_ms']:7.2f} ms  p95 {results['ingest']['p95_ms']:7.2f} ms  "
+          f"p99 {results['ingest']['p99_ms']:7.2f} ms")
+    print(f"  upstream   {cursor['upstream']:,} requests for {requests_total:,} session requests "
+          f"(fan-out 1:{results['fanout']:,.2f})")
+    for op, r in results["sessions"].items():
+        print(f"  {op:<10} {r['per_s']:8,.0f} req/s  p50 {r['p50_ms']:7.2f} ms  p95 {r['p95_ms']:7.2f} ms  p99 {r['p99_ms']:7.2f} ms")
+    sse = results["sse"]
+    print(f"  sse        {sse['frames']:,}/{sse['expected']:,} frames  p50 {sse['p50_ms']:7.2f} ms  "
+          f"p95 {sse['p95_ms']:7.2f} ms  p99 {sse['p99_ms']:7.2f} ms")
+    print(f"  alerts     {fired}/{args.sessions} fired")
+    return results
+
+
+def git_commit():
+    import subprocess
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+
+def bench_suite(args):
+    """Runs the offline suite and writes every number to a JSON file."""
+    import json
+    ns = argparse.Namespace
+    results = {
+        "parse": bench_parse(ns(fixtures=FIXTURES_DIR, repeat=args.repeat * 10)),
+        "fetch": bench_fetch(ns(delays=args.delays, repeat=args.repeat)),
+        "history": {}, "filter": {},
+        "quote": bench_quote(ns(items=10_000, repeat=args.repeat)),
+        "render": bench_render(ns(repeat=args.repeat)),
+        "interact": bench_interact(ns(repeat=args.repeat)),
+    }
+    for rows in args.history_sizes:
+        print(f"-- history {rows:,} rows")
+        results["history"][str(rows)] = bench_history(ns(rows=rows, repeat=args.repeat))
+    for rows in args.filter_sizes:
+        print(f"-- filter {rows:,} rows")
+        results["filter"][str(rows)] = bench_filter(ns(rows=rows, repeat=args.repeat))
+
+    report = {"commit": git_commit(), "timestamp": pd.Timestamp.now().isoformat(), "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+
+
+def flatten(tree, prefix=""):
+    out = {}
+    for key, value in tree.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            out.update(flatten(value, name))
+        elif isinstance(value, (int, float)):
+            out[name] = value
+    return out
+
+
+def bench_compare(args):
+    """Prints every metric of two suite reports side by side with the ratio."""
+    import json
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    a, b = flatten(old["results"]), flatten(new["results"])
+    print(f"{'metric':<48} {old.get('commit') or 'old':>12} {new.get('commit') or 'new':>12}  ratio")
+    for name in sorted(set(a) & set(b)):
+        ratio = b[name] / a[name] if a[name] else float("nan")
+        flag = "  <-- slower" if ratio > 1 + args.threshold and not name.endswith("req_per_s") else ""
+        print(f"{name:<48} {a[name]:12.2f} {b[name]:12.2f}  {ratio:5.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thai Gold Live benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("parse", help="GTA homepage parse time per engine")
+    p.add_argument("--fixtures", default=FIXTURES_DIR)
+    p.add_argument("--repeat", type=int, default=50)
+    p.set_defaults(func=bench_parse)
+
+    p = sub.add_parser("history", help="history store load/range query time")
+    p.add_argument("--rows", type=int, default=1_000_000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_history)
+
+    p = sub.add_parser("filter", help="filter_history period slicing time")
+    p.add_argument("--rows", type=int, default=10_000_000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_filter)
+
+    p = sub.add_parser("quote", help="catalogue repricing, scalar vs batch")
+    p.add_argument("--items", type=int, default=10_000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_quote)
+
+    p = sub.add_parser("api", help="load-test the JSON price API")
+    p.add_argument("--url", help="defaults to a local server backed by a stub poller")
+    p.add_argument("--clients", type=int, default=16)
+    p.add_argument("--seconds", type=float, default=5)
+    p.add_argument("--conditional", action="store_true", help="send If-None-Match like a well-behaved poller")
+    p.set_defaults(func=bench_api)
+
+    p = sub.add_parser("stream", help="SSE fan-out latency to idle viewers")
+    p.add_argument("--clients", type=int, default=500)
+    p.add_argument("--ticks", type=int, default=10)
+    p.set_defaults(func=bench_stream)
+
+    p = sub.add_parser("fetch", help="upstream latency against the stub with injected delay")
+    p.add_argument("--delays", type=float, nargs="+", default=[0.0, 0.2, 1.0])
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_fetch)
+
+    p = sub.add_parser("render", help="full app.py render time via AppTest")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_render)
+
+    p = sub.add_parser("stress", help="multiprocess history writes: integrity and latency")
+    p.add_argument("--procs", type=int, default=4)
+    p.add_argument("--threads", type=int, default=4)
+    p.add_argument("--seconds", type=float, default=5.0)
+    p.add_argument("--tick", type=float, default=0.01, help="seconds between announcements")
+    p.add_argument("--backends", nargs="+", default=["csv", "sqlite"])
+    p.set_defaults(func=bench_stress)
+
+    p = sub.add_parser("backfill", help="tools.py backfill over a generated GTA archive")
+    p.add_argument("--pages", type=int, default=5000)
+    p.add_argument("--workers", type=int)
+    p.add_argument("--gzip", action="store_true", help="write the archive as .html.gz")
+    p.add_argument("--backend", choices=["sqlite", "csv"], default="sqlite")
+    p.set_defaults(func=bench_backfill)
+
+    p = sub.add_parser("replay", help="replay history ticks under simulated sessions")
+    p.add_argument("--csv", help="history CSV to replay (default: synthetic ticks)")
+    p.add_argument("--rows", type=int, default=2000, help="ticks to replay (last N rows of --csv)")
+    p.add_argument("--step", type=float, default=300, help="seconds between synthetic ticks")
+    p.add_argument("--speedup", type=float, default=1000)
+    p.add_argument("--max-wait", type=float, default=1.0, help="cap on the wall-clock gap between ticks")
+    p.add_argument("--sessions", type=int, default=50)
+    p.add_argument("--viewers", type=int, default=20, help="SSE connections")
+    p.add_argument("--think", type=float, default=0.2, help="mean seconds between a session's requests")
+    p.set_defaults(func=bench_replay)
+
+    p = sub.add_parser("interact", help="CPU per widget interaction: full rerun vs fragment")
+    p.add_argument("--repeat", type=int, default=10)
+    p.set_defaults(func=bench_interact)
+
+    p = sub.add_parser("suite", help="run the offline suite and write JSON results")
+    p.add_argument("--out", default="bench_results.json")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--delays", type=float, nargs="+", default=[0.0, 0.2, 1.0])
+    p.add_argument("--history-sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    p.add_argument("--filter-sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    p.set_defaults(func=bench_suite)
+
+    p = sub.add_parser("compare", help="compare two suite JSON files")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.10, help="flag metrics slower by more than this")
+    p.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Maintenance commands for Thai Gold Live.
+
+Usage:
+    python tools.py migrate [--csv gold_history.csv] [--db gold_history.db]
+    python tools.py compact [--backend sqlite|csv]
+    python tools.py quote catalogue.csv [--out quotes.csv]
+    python tools.py backfill archive_dir/ [--workers N] [--backend sqlite|csv]
+"""
+import argparse
+import os
+
+from datetime import datetime
+
+from utils import DataManager, SQLiteHistoryStore, GoldConverter, GTAParser, RateManager, HISTORY_COLUMNS
+
+
+def cmd_migrate(args):
+    """Copies the legacy history CSV into the SQLite store."""
+    if not os.path.exists(args.csv):
+        print(f"{args.csv} not found, nothing to migrate")
+        return
+    if os.path.exists(args.db) and not args.force:
+        print(f"{args.db} already exists, pass --force to append into it")
+        return
+    store = SQLiteHistoryStore(args.db)
+    DataManager.migrate_csv(args.csv, store)
+    DataManager.get_rollups().rebuild(store.load())
+
+
+def cmd_compact(args):
+    """Drops duplicate snapshots from the history store."""
+    if args.backend:
+        DataManager.BACKEND = args.backend
+    before, after = DataManager.compact()
+    print(f"Compacted history: {before} -> {after} rows ({before - after} duplicates removed)")
+
+
+def cmd_quote(args):
+    """Reprices a catalogue CSV against the latest stored GTA snapshot."""
+    prices = DataManager.get_store().last()
+    if prices is None:
+        print("No price history yet, run the app first")
+        return
+    prices = {k: float(prices[k]) for k in ("bullion_sell", "ornament_sell")}
+    rate = RateManager.get_final_rates()["buy"]
+    quotes = GoldConverter.quote_catalogue(GoldConverter.load_catalogue(args.catalogue), prices, rate)
+    GoldConverter.export_quotes(quotes, args.out)
+    print(f"Quoted {len(quotes)} items at bullion {prices['bullion_sell']:,.0f} / "
+          f"ornament {prices['ornament_sell']:,.0f} THB, 1 CNY = {rate:.2f} THB -> {args.out}")
+
+
+ARCHIVE_SUFFIXES = (".html", ".htm", ".html.gz", ".htm.gz")
+
+
+def archive_files(root):
+    for dirpath, _, names in os.walk(root):
+        for name in sorted(names):
+            if name.lower().endswith(ARCHIVE_SUFFIXES):
+                yield os.path.join(dirpath, name)
+
+
+def parse_archive(path):
+    """Worker: one archived GTA page -> history row, or None if it has no prices."""
+    import gzip
+    try:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            html = f.read().decode("utf-8", errors="replace")
+        data = GTAParser.parse(html)
+    except Exception as e:
+        print(f"Skipping {path}: {e}")
+        return None
+    if not data or not data.get("update_time") or not data.get("bullion_sell"):
+        return None
+    # Announcement time from the page itself; the file's mtime if it can't be read
+    when = GTAParser.announced_at(data["update_time"]) or datetime.fromtimestamp(os.path.getmtime(path))
+    data["timestamp"] = when.strftime("%Y-%m-%d %H:%M:%S")
+    return data
+
+
+def cmd_backfill(args):
+    """Imports archived GTA pages into history across a process pool."""
+    from concurrent.futures import ProcessPoolExecutor
+    import time
+    if args.backend:
+        DataManager.BACKEND = args.backend
+    store = DataManager.get_store()
+    seen = set(store.load()["update_time"].dropna().astype(str))
+    paths = list(archive_files(args.directory))
+    print(f"Parsing {len(paths)} pages with {args.workers or os.cpu_count()} workers "
+          f"({len(seen)} announcements already stored)")
+
+    start = time.perf_counter()
+    batch, added, skipped = [], 0, 0
+    lock = DataManager.get_writer().lock
+
+    def flush():
+        nonlocal added
+        with lock: # Short hold per batch so a running app can keep recording
+            added += store.append(batch, durable=True)
+        batch.clear()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for row in pool.map(parse_archive, paths, chunksize=args.chunksize):
+            if row is None or row["update_time"] in seen:
+                skipped += 1
+                continue
+            seen.add(row["update_time"])
+            batch.append({col: row.get(col) for col in HISTORY_COLUMNS})
+            if len(batch) >= args.batch:
+                flush()
+    if batch:
+        flush()
+    print(f"Imported {added} rows, skipped {skipped} in {time.perf_counter() - start:.1f} s")
+
+    # Archives arrive in any order: sort, drop leftovers and rebuild rollups once
+    before, after = DataManager.compact()
+    print(f"Compacted history: {before} -> {after} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thai Gold Live maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="one-shot CSV -> SQLite history migration")
+    p.add_argument("--csv", default=DataManager.HISTORY_FILE)
+    p.add_argument("--db", default=DataManager.HISTORY_DB)
+    p.add_argument("--force", action="store_true")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("compact", help="rewrite history without duplicate snapshots")
+    p.add_argument("--backend", choices=["sqlite", "csv"])
+    p.set_defaults(func=cmd_compact)
+
+    p = sub.add_parser("quote", help="bulk-price a catalogue CSV")
+    p.add_argument("catalogue")
+    p.add_argument("--out", default="quotes.csv")
+    p.set_defaults(func=cmd_quote)
+
+    p = sub.add_parser("backfill", help="import a directory of archived GTA pages")
+    p.add_argument("directory")
+    p.add_argument("--workers", type=int, help="processes (default: CPU count)")
+    p.add_argument("--chunksize", type=int, default=256, help="pages handed to a worker at a time")
+    p.add_argument("--batch", type=int, default=5000, help="rows per store append")
+    p.add_argument("--backend", choices=["sqlite", "csv"])
+    p.set_defaults(func=cmd_backfill)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
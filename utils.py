@@ -2,8 +2,323 @@ import requests
 from bs4 import BeautifulSoup
 import re
 from datetime import datetime
+import numpy as np
 import pandas as pd
+import functools
+import itertools
 import os
+import random
+import threading
+import time
+from types import MappingProxyType
+
+class Metrics:
+    """
+    In-process timings and counters for the hot paths (upstream fetches,
+    history I/O, page sections). Each stage keeps its last WINDOW samples
+    for p50/p95/p99; counters are monotonic. Exported as a dict for the
+    admin panel and as Prometheus text for /metrics.
+    """
+    WINDOW = 1024 # Samples kept per stage for percentiles
+    QUANTILES = (50, 95, 99)
+    _stages = {} # stage -> {"samples": deque, "count": int, "sum": float}
+    _counters = {} # (name, labels) -> int
+    _lock = threading.Lock()
+
+    @staticmethod
+    def observe(stage, seconds):
+        from collections import deque
+        with Metrics._lock:
+            entry = Metrics._stages.get(stage)
+            if entry is None:
+                entry = Metrics._stages[stage] = {"samples": deque(maxlen=Metrics.WINDOW), "count": 0, "sum": 0.0}
+            entry["samples"].append(seconds)
+            entry["count"] += 1
+            entry["sum"] += seconds
+
+    @staticmethod
+    def incr(name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with Metrics._lock:
+            Metrics._counters[key] = Metrics._counters.get(key, 0) + n
+
+    @staticmethod
+    def timer(stage):
+        """Context manager recording the wall time of its block under stage."""
+        from contextlib import contextmanager
+
+        @contextmanager
+        def timing():
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                Metrics.observe(stage, time.perf_counter() - start)
+        return timing()
+
+    @staticmethod
+    def timed(stage):
+        """Decorator form of timer()."""
+        from functools import wraps
+
+        def decorate(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with Metrics.timer(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    @staticmethod
+    def stopwatch(prefix):
+        """
+        Returns lap(name): records the time since the previous lap (or since
+        creation) as stage "prefix.name". Lets a script time consecutive
+        sections without wrapping each one in a block. lap(None) restarts
+        the clock without recording, e.g. after a section timed on its own.
+        """
+        last = [time.perf_counter()]
+
+        def lap(name):
+            now = time.perf_counter()
+            if name is not None:
+                Metrics.observe(f"{prefix}.{name}", now - last[0])
+            last[0] = now
+        return lap
+
+    @staticmethod
+    def summary():
+        """{"stages": {stage: {count, sum, p50, p95, p99}}, "counters": {name{labels}: n}}, times in ms."""
+        with Metrics._lock:
+            stages = {k: (list(v["samples"]), v["count"], v["sum"]) for k, v in Metrics._stages.items()}
+            counters = dict(Metrics._counters)
+        out = {"stages": {}, "counters": {}}
+        for stage, (samples, count, total) in sorted(stages.items()):
+            qs = np.percentile(samples, Metrics.QUANTILES) * 1000 if samples else [0.0] * len(Metrics.QUANTILES)
+            row = {"count": count, "sum_ms": total * 1000}
+            row.update({f"p{q}": float(v) for q, v in zip(Metrics.QUANTILES, qs)})
+            out["stages"][stage] = row
+        for (name, labels), n in sorted(counters.items()):
+            label = ",".join(f"{k}={v}" for k, v in labels)
+            out["counters"][f"{name}{{{label}}}" if label else name] = n
+        return out
+
+    @staticmethod
+    def prometheus():
+        """Prometheus text exposition: one summary per stage, one counter per name."""
+        with Metrics._lock:
+            stages = {k: (list(v["samples"]), v["count"], v["sum"]) for k, v in Metrics._stages.items()}
+            counters = dict(Metrics._counters)
+        lines = []
+        if stages:
+            lines += ["# HELP thaigold_stage_seconds Wall time per instrumented stage.",
+                      "# TYPE thaigold_stage_seconds summary"]
+        for stage, (samples, count, total) in sorted(stages.items()):
+            if samples:
+                for q, v in zip(Metrics.QUANTILES, np.percentile(samples, Metrics.QUANTILES)):
+                    lines.append(f'thaigold_stage_seconds{{stage="{stage}",quantile="{q / 100:g}"}} {v:.6f}')
+            lines.append(f'thaigold_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'thaigold_stage_seconds_count{{stage="{stage}"}} {count}')
+        typed = set()
+        for (name, labels), n in sorted(counters.items()):
+            metric = f"thaigold_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            label = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{metric}{{{label}}} {n}" if label else f"{metric} {n}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def reset():
+        with Metrics._lock:
+            Metrics._stages.clear()
+            Metrics._counters.clear()
+
+class UpstreamError(Exception):
+    """Raised when an upstream request still fails after all retries."""
+
+class CircuitOpenError(UpstreamError):
+    """Raised without touching the network while a source's circuit is open."""
+
+class CircuitBreaker:
+    """
+    Per-source breaker: after FAILURE_THRESHOLD consecutive failures the
+    circuit opens and calls fail fast for RESET_TIMEOUT seconds; then one
+    trial call is let through (half-open) to decide whether to close again.
+    """
+    FAILURE_THRESHOLD = 3
+    RESET_TIMEOUT = 60
+    _breakers = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or CircuitBreaker.FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or CircuitBreaker.RESET_TIMEOUT
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def for_source(name):
+        """Returns the shared breaker for a source (e.g. an upstream host)."""
+        with CircuitBreaker._registry_lock:
+            if name not in CircuitBreaker._breakers:
+                CircuitBreaker._breakers[name] = CircuitBreaker(name)
+            return CircuitBreaker._breakers[name]
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def call(self, fn, *args, **kwargs):
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self._trial_running):
+                raise CircuitOpenError(f"{self.name} circuit open after {self.failures} failures")
+            self._trial_running = state == "half-open"
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+                self._trial_running = False
+                if state == "half-open" or self.failures >= self.failure_threshold:
+                    self.opened_at = time.time()
+            raise
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+        return result
+
+class UpstreamClient:
+    """
+    Shared HTTP layer for every upstream (GTA, open.er-api).
+    One pooled keep-alive session per process, bounded retries with jittered
+    backoff, and ETag/Last-Modified revalidation so unchanged pages cost a 304.
+    """
+    POOL_MAXSIZE = 4 # Max open connections per host
+    RETRIES = 2 # Extra attempts after the first one
+    BACKOFF = 0.5 # Seconds, doubled on each retry
+    JITTER = 0.25 # Max random seconds added to each backoff
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    MIN_ATTEMPT = 1.0 # Seconds of budget an attempt needs before it is worth starting
+    HEADERS = {"User-Agent": "ThaiGoldLive/1.0 (+https://github.com/kelvinbo/thai-gold)"}
+
+    _session = None
+    _lock = threading.Lock()
+    _validators = {} # url -> {"etag", "last_modified", "body"}
+    _budget = threading.local() # .deadline: time.monotonic() by which calls on this thread must finish
+
+    @staticmethod
+    def session():
+        """Returns the process-wide pooled session, creating it on first use."""
+        with UpstreamClient._lock:
+            if UpstreamClient._session is None:
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                session.headers.update(UpstreamClient.HEADERS)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=UpstreamClient.POOL_MAXSIZE,
+                                      pool_block=True, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                UpstreamClient._session = session
+            return UpstreamClient._session
+
+    @staticmethod
+    def deadline(at):
+        """Context manager capping every get() on this thread to finish by monotonic time at."""
+        from contextlib import contextmanager
+
+        @contextmanager
+        def budget():
+            previous = getattr(UpstreamClient._budget, "deadline", None)
+            UpstreamClient._budget.deadline = at
+            try:
+                yield
+            finally:
+                UpstreamClient._budget.deadline = previous
+        return budget()
+
+    @staticmethod
+    def get(url, timeout=10):
+        """
+        Conditional GET with retries, guarded by the host's circuit breaker.
+        Returns (text, modified); modified is False when the server answered
+        304 and text is the cached body from the previous 200.
+        Raises CircuitOpenError immediately while the host's circuit is open.
+        """
+        from urllib.parse import urlparse
+        host = urlparse(url).netloc
+        breaker = CircuitBreaker.for_source(host)
+        try:
+            text, modified = breaker.call(UpstreamClient._get, url, timeout)
+        except CircuitOpenError:
+            Metrics.incr("upstream_errors", host=host, kind="circuit_open")
+            raise
+        except Exception:
+            Metrics.incr("upstream_errors", host=host, kind="failed")
+            raise
+        Metrics.incr("cache", cache="http_etag", result="miss" if modified else "hit")
+        return text, modified
+
+    @staticmethod
+    def _get(url, timeout):
+        from urllib.parse import urlparse
+        cached = UpstreamClient._validators.get(url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        # Under a deadline, attempts shrink to the time left and no retry starts that could not finish
+        end = getattr(UpstreamClient._budget, "deadline", None)
+        last_error, attempts = None, 0
+        for attempt in range(UpstreamClient.RETRIES + 1):
+            if attempt:
+                delay = UpstreamClient.BACKOFF * 2 ** (attempt - 1) + random.uniform(0, UpstreamClient.JITTER)
+                if end is not None and time.monotonic() + delay + UpstreamClient.MIN_ATTEMPT > end:
+                    break
+                time.sleep(delay)
+            attempt_timeout = timeout
+            if end is not None:
+                attempt_timeout = min(timeout, max(end - time.monotonic(), UpstreamClient.MIN_ATTEMPT))
+            attempts += 1
+            try:
+                resp = UpstreamClient.session().get(url, headers=headers, timeout=attempt_timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+                Metrics.incr("upstream_retries", host=urlparse(url).netloc)
+                continue
+            if resp.status_code == 304 and cached:
+                return cached["body"], False
+            if resp.status_code in UpstreamClient.RETRY_STATUSES:
+                last_error = requests.HTTPError(f"{resp.status_code} from {url}")
+                Metrics.incr("upstream_retries", host=urlparse(url).netloc)
+                continue
+            try:
+                resp.raise_for_status()
+            except requests.HTTPError as e:
+                raise UpstreamError(str(e)) from e
+
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            if etag or last_modified:
+                with UpstreamClient._lock:
+                    UpstreamClient._validators[url] = {
+                        "etag": etag, "last_modified": last_modified, "body": resp.text
+                    }
+            return resp.text, True
+        raise UpstreamError(f"{url} failed after {attempts} attempts: {last_error}")
 
 class ThaiGoldScraper:
     GTA_URL = "https://www.goldtraders.or.th/"
@@ -16,31 +331,48 @@ class ThaiGoldScraper:
         "tax_base": "#DetailPlace_uc_goldprices1_lblOMBuy",
         "update_time": "#DetailPlace_uc_goldprices1_lblAsTime"
     }
+    _last_prices = None
 
     @staticmethod
+    @Metrics.timed("gta.get_latest_prices")
     def get_latest_prices():
+        """
+        Returns the live GTA prices plus staleness metadata ("stale", "as_of").
+        If GTA fails or its circuit is open, answers with the last good
+        prices instead, marked stale.
+        """
         try:
-            response = requests.get(ThaiGoldScraper.GTA_URL, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            data = {}
-            for key, selector in ThaiGoldScraper.GTA_SELECTORS.items():
-                element = soup.select_one(selector)
-                if element:
-                    text_val = element.get_text().strip()
-                    if key != 'update_time':
-                        num_str = re.sub(r'[^\d.]', '', text_val)
-                        data[key] = float(num_str) if num_str else 0.0
-                    else:
-                        data[key] = text_val
-                else:
-                    data[key] = None
-            
-            return data
+            html, modified = UpstreamClient.get(ThaiGoldScraper.GTA_URL, timeout=10)
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if not modified and ThaiGoldScraper._last_prices:
+                # 304: page unchanged since the last parse
+                ThaiGoldScraper._last_prices["as_of"] = now
+                return dict(ThaiGoldScraper._last_prices)
+            data = GTAParser.parse(html)
+            data.update(stale=False, as_of=now)
+            ThaiGoldScraper._last_prices = data
+            return dict(data)
         except Exception as e:
             print(f"GTA Scraping error: {e}")
+            return ThaiGoldScraper.last_known_prices()
+
+    @staticmethod
+    def last_known_prices():
+        """Last good prices from memory, else from stored history; None if neither exists."""
+        if ThaiGoldScraper._last_prices:
+            return dict(ThaiGoldScraper._last_prices, stale=True)
+        try:
+            row = DataManager.get_store().last()
+        except Exception as e:
+            print(f"History fallback error: {e}")
             return None
+        if not row:
+            return None
+        data = {key: row.get(key) for key in ThaiGoldScraper.GTA_SELECTORS}
+        for key in PRICE_COLUMNS:
+            data[key] = float(data[key]) if data[key] not in (None, '') else None
+        data.update(stale=True, as_of=str(row['timestamp']))
+        return data
 
     @staticmethod
     def get_superrich_rates():
@@ -49,45 +381,300 @@ class ThaiGoldScraper:
         """
         return RateManager.get_final_rates()
 
+class GTAParser:
+    """
+    Extracts the GTA_SELECTORS fields from the GTA homepage.
+    Engines are tried in ENGINES order; the first one that finds every
+    field wins, and "soup" (full BeautifulSoup tree) is the final fallback.
+    """
+    ENGINES = ["fast", "lxml", "soup"]
+
+    # Matches any GTA price span by id, e.g. id="DetailPlace_uc_goldprices1_lblBLSell"
+    SPAN_PATTERN = re.compile(
+        r'<span\b[^>]*?\bid=["\'](DetailPlace_uc_goldprices1_lbl\w+)["\'][^>]*>(.*?)</span>',
+        re.S | re.I
+    )
+    TAG_PATTERN = re.compile(r'<[^>]+>')
+
+    @staticmethod
+    def _clean(key, text_val):
+        text_val = text_val.strip()
+        if key != 'update_time':
+            num_str = re.sub(r'[^\d.]', '', text_val)
+            return float(num_str) if num_str else 0.0
+        return text_val
+
+    @staticmethod
+    def _element_ids():
+        return {sel.lstrip('#'): key for key, sel in ThaiGoldScraper.GTA_SELECTORS.items()}
+
+    @staticmethod
+    def parse_fast(html):
+        """Regex span scanner that stops as soon as every field is found."""
+        import html as html_lib
+        wanted = GTAParser._element_ids()
+        data = {}
+        for match in GTAParser.SPAN_PATTERN.finditer(html):
+            key = wanted.get(match.group(1))
+            if key is None or key in data:
+                continue
+            text_val = html_lib.unescape(GTAParser.TAG_PATTERN.sub('', match.group(2)))
+            data[key] = GTAParser._clean(key, text_val)
+            if len(data) == len(wanted):
+                break
+        return {key: data.get(key) for key in ThaiGoldScraper.GTA_SELECTORS}
+
+    @staticmethod
+    def parse_lxml(html):
+        """lxml tree lookup by id. Raises ImportError if lxml is not installed."""
+        import lxml.html
+        tree = lxml.html.fromstring(html)
+        data = {}
+        for element_id, key in GTAParser._element_ids().items():
+            found = tree.xpath(f'//*[@id="{element_id}"]')
+            data[key] = GTAParser._clean(key, found[0].text_content()) if found else None
+        return data
+
+    @staticmethod
+    def parse_soup(html):
+        """Original full-tree BeautifulSoup path, kept as the safe fallback."""
+        soup = BeautifulSoup(html, 'html.parser')
+        data = {}
+        for key, selector in ThaiGoldScraper.GTA_SELECTORS.items():
+            element = soup.select_one(selector)
+            data[key] = GTAParser._clean(key, element.get_text()) if element else None
+        return data
+
+    # "18/10/2569 เวลา 09:28 น. (ครั้งที่ 2)": Buddhist-era date, then the time
+    UPDATE_TIME_PATTERN = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})\D+?(\d{1,2})[:.](\d{2})')
+
+    @staticmethod
+    def announced_at(update_time):
+        """Parses a GTA update_time into a datetime (Gregorian); None if unrecognised."""
+        match = GTAParser.UPDATE_TIME_PATTERN.search(update_time or '')
+        if not match:
+            return None
+        day, month, year, hour, minute = (int(g) for g in match.groups())
+        if year > 2400:
+            year -= 543
+        try:
+            return datetime(year, month, day, hour, minute)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def parse(html, engines=None):
+        """Parses with the first engine that returns a complete result."""
+        data = None
+        for name in engines or GTAParser.ENGINES:
+            try:
+                data = getattr(GTAParser, f"parse_{name}")(html)
+            except ImportError:
+                continue
+            if all(v is not None for v in data.values()):
+                return data
+        return data
+
 class RateManager:
     CONFIG_FILE = "rate_config.json"
     BASE_API_URL = "https://open.er-api.com/v6/latest/CNY"
+    FALLBACK_RATE = 4.50
+    RATE_TTL = 600 # seconds a fetched base rate counts as fresh
+
+    # Counter rules per currency, as THB per 1 unit: (rounding step, sell spread).
+    # CNY is the SuperRich anchor (nearest 0.05, sell = buy + 0.20).
+    CURRENCY_RULES = {
+        "CNY": (0.05, 0.20),
+        "USD": (0.05, 0.30),
+        "EUR": (0.05, 0.40),
+        "HKD": (0.01, 0.05),
+        "JPY": (0.0001, 0.0040),
+    }
+    DEFAULT_RULE = (0.01, 0.05)
+    CURRENCIES = ["CNY", "USD", "EUR", "HKD", "JPY"] # Shown in the app and in every rates payload
+
+    # In-process caches shared by every session.
+    # "table" is the whole open.er-api vector: units of each currency per 1 CNY.
+    _rate = {"value": None, "table": None, "fetched_at": 0.0, "stale": True} # See reset_cache
+    _rate_lock = threading.Lock()
+    _refreshing = threading.Lock() # Held by the one refresh in flight
+    _config = {"key": None, "value": {"offset": 0.0}}
     
     @staticmethod
-    def get_base_rate():
-        """Fetches the official CNY -> THB rate from a stable open API."""
+    def reset_cache():
+        """Forgets the cached base rate and table (tests, benchmarks, switching upstreams)."""
+        RateManager._rate = {"value": None, "table": None, "fetched_at": 0.0, "stale": True}
+
+    @staticmethod
+    def fetch_rate_table():
+        """Fetches the full CNY-based rate table ({currency: units per 1 CNY}) in one request (no cache)."""
+        import json
+        text, _ = UpstreamClient.get(RateManager.BASE_API_URL, timeout=5)
+        data = json.loads(text)
+        return {code: float(value) for code, value in data['rates'].items()}
+
+    @staticmethod
+    def fetch_base_rate():
+        """Fetches the official CNY -> THB rate from a stable open API (no cache)."""
+        # 1 CNY = X THB
+        return RateManager.fetch_rate_table()['THB']
+
+    @staticmethod
+    def _refresh_rate():
         try:
-            resp = requests.get(RateManager.BASE_API_URL, timeout=5)
-            data = resp.json()
-            # 1 CNY = X THB
-            return float(data['rates']['THB'])
+            table = RateManager.fetch_rate_table()
+            value = table['THB']
+            RateManager._rate = {"value": value, "table": table, "fetched_at": time.time(), "stale": False}
+            return value
         except Exception as e:
             print(f"Base Rate Error: {e}")
-            return 4.50 # Fallback
+            return None
+        finally:
+            RateManager._refreshing.release()
+
+    @staticmethod
+    @Metrics.timed("rate.get_base_rate")
+    def get_base_rate():
+        """
+        Returns the CNY -> THB base rate with stale-while-revalidate caching:
+        fresh values come from memory, stale ones are served while a single
+        background refresh runs, and only a cold cache waits on the API.
+        """
+        cached = RateManager._rate
+        age = time.time() - cached["fetched_at"]
+        if cached["value"] is not None:
+            Metrics.incr("cache", cache="base_rate", result="hit" if age < RateManager.RATE_TTL else "stale")
+            if age >= RateManager.RATE_TTL and RateManager._refreshing.acquire(blocking=False):
+                threading.Thread(target=RateManager._refresh_rate, name="rate-refresh", daemon=True).start()
+            return cached["value"]
+
+        # Cold cache: one caller fetches, concurrent callers wait and reuse it
+        Metrics.incr("cache", cache="base_rate", result="miss")
+        with RateManager._rate_lock:
+            if RateManager._rate["value"] is not None:
+                return RateManager._rate["value"]
+            RateManager._refreshing.acquire()
+            value = RateManager._refresh_rate()
+        if value is None:
+            # Last known good: the base seen at the last calibration, else the hard default
+            value = RateManager.load_config().get("last_calibrated_base") or RateManager.FALLBACK_RATE
+        return value
+
+    @staticmethod
+    def rate_status():
+        """Staleness of the base rate: {"stale": bool, "as_of": str or None}."""
+        cached = RateManager._rate
+        if cached["value"] is None:
+            return {"stale": True, "as_of": None}
+        age = time.time() - cached["fetched_at"]
+        return {
+            # Past two TTLs means background refreshes have been failing
+            "stale": age >= 2 * RateManager.RATE_TTL,
+            "as_of": datetime.fromtimestamp(cached["fetched_at"]).strftime("%Y-%m-%d %H:%M:%S"),
+        }
 
     @staticmethod
     def load_config():
-        """Loads the manual offset from local config."""
-        if not os.path.exists(RateManager.CONFIG_FILE):
-            return {"offset": 0.0}
+        """Loads the manual offset from local config, re-reading only when the file changes."""
         try:
-            import json
-            with open(RateManager.CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except:
+            st = os.stat(RateManager.CONFIG_FILE)
+        except FileNotFoundError:
             return {"offset": 0.0}
+        key = (st.st_mtime_ns, st.st_size)
+        if RateManager._config["key"] != key:
+            try:
+                import json
+                with open(RateManager.CONFIG_FILE, 'r') as f:
+                    value = json.load(f)
+            except:
+                value = {"offset": 0.0}
+            RateManager._config = {"key": key, "value": value}
+        return dict(RateManager._config["value"])
 
     @staticmethod
-    def save_offset(real_superrich_price):
-        """Calculates and saves the offset based on manual input."""
-        base = RateManager.get_base_rate()
+    def get_rate_table(base=None):
+        """
+        The cached rate table ({currency: units per 1 CNY}), refreshed with the
+        base rate, so extra currencies cost no extra upstream requests.
+        Falls back to CNY/THB only when the table has never been fetched.
+        Pass base when it was just read, to skip a second get_base_rate().
+        """
+        if base is None:
+            base = RateManager.get_base_rate()
+        table = RateManager._rate["table"]
+        return table if table else {"CNY": 1.0, "THB": base}
+
+    @staticmethod
+    def rate_matrix(currencies=None):
+        """Cross rates: matrix.loc[a, b] = units of b per 1 unit of a (mid-market)."""
+        table = RateManager.get_rate_table()
+        codes = [c for c in currencies or sorted(table) if c in table]
+        per_cny = np.array([table[c] for c in codes])
+        return pd.DataFrame(per_cny[None, :] / per_cny[:, None], index=codes, columns=codes)
+
+    @staticmethod
+    def save_offset(real_superrich_price, currency="CNY"):
+        """Calculates and saves the offset for currency based on manual input (THB per 1 unit)."""
+        if currency == "CNY":
+            base = RateManager.get_base_rate()
+        else:
+            base = float(RateManager.rate_matrix([currency, "THB"]).loc[currency, "THB"])
         offset = real_superrich_price - base
         
         import json
-        with open(RateManager.CONFIG_FILE, 'w') as f:
-            json.dump({"offset": offset, "last_calibrated_base": base, "manual_price": real_superrich_price}, f)
+        config = RateManager.load_config()
+        if currency == "CNY":
+            config.update({"offset": offset, "last_calibrated_base": base, "manual_price": real_superrich_price})
+        else:
+            config.setdefault("offsets", {})[currency] = offset
+        # Write-then-rename so readers never see a half-written config; a unique
+        # temp file keeps replicas saving at once from mixing their writes
+        import tempfile
+        path = os.path.abspath(RateManager.CONFIG_FILE)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(config, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
         return offset
 
+    @staticmethod
+    def get_currency_rates(currencies=None, table=None):
+        """
+        Counter rates in THB per 1 unit for each currency, from one cached
+        table: base (mid-market), offset (calibrated), buy (rounded to the
+        currency's step) and sell (buy + spread). One vectorized pass.
+        """
+        table = table or RateManager.get_rate_table()
+        config = RateManager.load_config()
+        offsets = dict(config.get("offsets", {}), CNY=config.get("offset", 0.0))
+        codes = [c for c in currencies or RateManager.CURRENCIES if c in table]
+        rules = np.array([RateManager.CURRENCY_RULES.get(c, RateManager.DEFAULT_RULE) for c in codes]).reshape(-1, 2)
+        step, spread = rules[:, 0], rules[:, 1]
+        base = table['THB'] / np.array([table[c] for c in codes])
+        offset = np.array([offsets.get(c, 0.0) for c in codes])
+        # Nearest step, then drop float noise (4.6000000000000005 -> 4.6)
+        buy = np.round(np.round((base + offset) / step) * step, 6)
+        return pd.DataFrame({"base": base, "offset": offset, "buy": buy, "sell": np.round(buy + spread, 6)}, index=codes)
+
+    @staticmethod
+    def convert(amounts_thb, currencies=None, side="buy"):
+        """
+        Converts THB amounts (e.g. gold prices) into other currencies at the
+        counter rate: a frame with one row per amount and one column per
+        currency. side="buy" is what a customer bringing that currency needs.
+        """
+        rates = RateManager.get_currency_rates(currencies)[side]
+        amounts = np.asarray(amounts_thb, dtype='float64').reshape(-1, 1)
+        index = amounts_thb.index if isinstance(amounts_thb, pd.Series) else None
+        return pd.DataFrame(amounts / rates.to_numpy()[None, :], columns=rates.index, index=index)
+
     @staticmethod
     def get_final_rates():
         """
@@ -98,6 +685,7 @@ class RateManager:
         4. Calculate Reverse (THB->CNY) = Buy Rate + 0.20
         """
         base = RateManager.get_base_rate()
+        table = RateManager.get_rate_table(base)
         config = RateManager.load_config()
         offset = config.get("offset", 0.0)
         
@@ -110,11 +698,16 @@ class RateManager:
         # Reverse Rate logic: Buy Rate + 0.20 (e.g. 4.50 + 0.20 = 4.70)
         final_sell = final_buy + 0.20
         
+        # Other currencies come from the same table: no extra requests, even on a cold cache
+        currencies = RateManager.get_currency_rates(table=table)[["base", "buy", "sell"]]
+        
         return {
             "buy": final_buy,  # The "SuperRich" Anchor
             "sell": final_sell, # The Reverse Rate
             "base_ref": base,
-            "is_calibrated": True
+            "is_calibrated": True,
+            "currencies": currencies.to_dict('index'),
+            **RateManager.rate_status()
         }
 
 class GoldConverter:
@@ -151,49 +744,1268 @@ class GoldConverter:
     def calculate_ornament_total(price_per_baht, weight_baht, gamnuy):
         return (price_per_baht * weight_baht) + gamnuy
 
+    # --- Batch (NumPy) counterparts: arrays in, arrays out ---
+    CATALOGUE_COLUMNS = ["sku", "weight_baht", "gamnuy", "type"]
+
+    @staticmethod
+    def _factors(is_ornament):
+        return np.where(np.asarray(is_ornament, dtype=bool),
+                        GoldConverter.BAHT_TO_GRAM_ORNAMENT, GoldConverter.BAHT_TO_GRAM_BULLION)
+
+    @staticmethod
+    def baht_to_gram_batch(weights_baht, is_ornament=False):
+        return np.asarray(weights_baht, dtype='float64') * GoldConverter._factors(is_ornament)
+
+    @staticmethod
+    def gram_to_baht_batch(weights_gram, is_ornament=False):
+        return np.asarray(weights_gram, dtype='float64') / GoldConverter._factors(is_ornament)
+
+    @staticmethod
+    def oz_to_baht_batch(weights_oz, is_ornament=False):
+        grams = np.asarray(weights_oz, dtype='float64') * GoldConverter.OZ_TO_GRAM
+        return GoldConverter.gram_to_baht_batch(grams, is_ornament)
+
+    @staticmethod
+    def ornament_total_batch(prices_per_baht, weights_baht, gamnuy):
+        return (np.asarray(prices_per_baht, dtype='float64') * np.asarray(weights_baht, dtype='float64')
+                + np.asarray(gamnuy, dtype='float64'))
+
+    @staticmethod
+    def quote_catalogue(items, prices, cny_rate=None):
+        """
+        Prices a whole catalogue in one pass.
+        items: DataFrame with weight_baht, gamnuy and optional type
+        ("bullion"/"ornament", default ornament).
+        prices: GTA snapshot; bullion uses bullion_sell, ornaments ornament_sell.
+        cny_rate: THB per CNY (RateManager "buy"); adds total_cny when given.
+        """
+        out = items.copy()
+        kind = out['type'] if 'type' in out.columns else pd.Series("ornament", index=out.index)
+        is_ornament = kind.fillna("ornament").astype(str).str.lower().ne("bullion").to_numpy()
+        gamnuy = out['gamnuy'].fillna(0) if 'gamnuy' in out.columns else 0.0
+
+        out['weight_gram'] = GoldConverter.baht_to_gram_batch(out['weight_baht'], is_ornament)
+        out['price_per_baht'] = np.where(is_ornament, prices['ornament_sell'], prices['bullion_sell'])
+        out['total_thb'] = GoldConverter.ornament_total_batch(out['price_per_baht'], out['weight_baht'], gamnuy)
+        if cny_rate:
+            out['total_cny'] = out['total_thb'] / cny_rate
+        return out
+
+    @staticmethod
+    def load_catalogue(path):
+        """Reads a catalogue CSV (sku, weight_baht, gamnuy, type)."""
+        return pd.read_csv(path, dtype={"sku": str})
+
+    @staticmethod
+    def export_quotes(quotes, path):
+        quotes.to_csv(path, index=False, float_format="%.2f")
+
+HISTORY_COLUMNS = ["bullion_sell", "bullion_buy", "ornament_sell", "tax_base", "update_time", "timestamp"]
+PRICE_COLUMNS = ["bullion_sell", "bullion_buy", "ornament_sell", "tax_base"]
+# Two snapshots with the same key are the same GTA announcement
+DEDUP_KEY = ["update_time"] + PRICE_COLUMNS
+# WAL keeps its index in host-local shared memory (-shm), so it is only safe when
+# every replica runs on one host. GOLD_SHARED_VOLUME=1 (replicas on several hosts
+# sharing e.g. an NFS volume) switches the SQLite stores to rollback journals.
+SQLITE_JOURNAL_MODE = "DELETE" if os.environ.get("GOLD_SHARED_VOLUME") else "WAL"
+
+def to_epoch(values, ceil=False):
+    """Naive timestamps -> integer seconds since 1970 (no timezone shift), rounded down or up."""
+    delta = pd.to_datetime(pd.Series(values)) - pd.Timestamp(1970, 1, 1)
+    if ceil:
+        return (-(-delta // pd.Timedelta(seconds=1))).astype('int64')
+    return (delta // pd.Timedelta(seconds=1)).astype('int64')
+
+def index_by_time(df):
+    """
+    Returns df sorted by timestamp with a matching DatetimeIndex, so range
+    queries can binary-search it. Already-indexed frames are returned as is.
+    """
+    if isinstance(df.index, pd.DatetimeIndex) and df.index.is_monotonic_increasing:
+        return df
+    if not df['timestamp'].is_monotonic_increasing:
+        df = df.sort_values('timestamp', kind='stable')
+    df = df.set_axis(pd.DatetimeIndex(df['timestamp'].values), axis=0)
+    return df
+
+def slice_by_time(df, start=None, end=None):
+    """Rows with start <= timestamp < end via searchsorted; a slice, not a masked copy."""
+    df = index_by_time(df)
+    i = df.index.searchsorted(pd.Timestamp(start), side='left') if start is not None else 0
+    j = df.index.searchsorted(pd.Timestamp(end), side='left') if end is not None else len(df)
+    return df.iloc[i:j]
+
+class CSVHistoryStore:
+    """
+    Append-only CSV backend (the original gold_history.csv format).
+    The parsed frame is cached together with the byte offset it covers, so
+    a reload only parses rows appended since the previous load.
+    """
+    FINGERPRINT_BYTES = 64
+
+    def __init__(self, path):
+        self.path = path
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def append(self, rows, durable=False):
+        """
+        Appends rows in a single write. A torn last line left by a crashed
+        writer is cut off first, and the header is written if the file is
+        empty. Callers must hold the history lock (see HistoryWriter) when
+        other processes may append concurrently. durable=True fsyncs.
+        """
+        df = pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+        if df.empty:
+            return 0
+        df['timestamp'] = pd.to_datetime(df['timestamp']).dt.strftime("%Y-%m-%d %H:%M:%S")
+        with open(self.path, 'a+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            header = size == 0
+            if size:
+                f.seek(max(0, size - 65536))
+                tail = f.read()
+                if not tail.endswith(b'\n'):
+                    cut = size - len(tail) + tail.rfind(b'\n') + 1
+                    print(f"Dropping torn history line at byte {cut}")
+                    f.truncate(cut)
+                    header = cut == 0
+            f.write(df.to_csv(index=False, header=header).encode('utf-8'))
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        return len(df)
+
+    def load(self, start=None, end=None):
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=HISTORY_COLUMNS)
+        with self._lock:
+            df = self._load_cached()
+        return slice_by_time(df, start, end)
+
+    def _load_cached(self):
+        """Returns the full frame, parsing only the appended tail when possible."""
+        import io
+        st = os.stat(self.path)
+        cache = self._cache
+        with open(self.path, 'rb') as f:
+            if cache and self._is_same_file(f, st, cache):
+                if st.st_size == cache['offset']:
+                    Metrics.incr("cache", cache="csv_history", result="hit")
+                    return cache['frame']
+                Metrics.incr("cache", cache="csv_history", result="tail")
+                f.seek(cache['offset'])
+                tail = f.read(st.st_size - cache['offset'])
+                end = tail.rfind(b'\n') + 1 # Ignore a half-written last line
+                if end == 0:
+                    return cache['frame']
+                new = pd.read_csv(io.BytesIO(tail[:end]), header=None, names=cache['columns'])
+                new['timestamp'] = pd.to_datetime(new['timestamp'])
+                frame = index_by_time(pd.concat([cache['frame'], index_by_time(new)]))
+                self._remember(f, st, frame, cache['offset'] + end, cache['columns'])
+                return frame
+
+            # First load, truncation or rewrite: parse everything
+            Metrics.incr("cache", cache="csv_history", result="miss")
+            self._cache = None
+            f.seek(0) # _is_same_file moved the position
+            data = f.read(st.st_size)
+            end = data.rfind(b'\n') + 1
+            frame = pd.read_csv(io.BytesIO(data[:end]))
+            frame['timestamp'] = pd.to_datetime(frame['timestamp'])
+            frame = index_by_time(frame)
+            self._remember(f, st, frame, end, list(frame.columns))
+            return frame
+
+    def _fingerprint(self, f, offset):
+        f.seek(max(0, offset - CSVHistoryStore.FINGERPRINT_BYTES))
+        return f.read(min(offset, CSVHistoryStore.FINGERPRINT_BYTES))
+
+    def _remember(self, f, st, frame, offset, columns):
+        self._cache = {
+            "frame": frame, "offset": offset, "columns": columns,
+            "ino": st.st_ino, "fingerprint": self._fingerprint(f, offset),
+        }
+
+    def _is_same_file(self, f, st, cache):
+        """False if the file was replaced, truncated or rewritten before our offset."""
+        return (st.st_ino == cache['ino'] and st.st_size >= cache['offset']
+                and self._fingerprint(f, cache['offset']) == cache['fingerprint'])
+
+    def last(self):
+        """Returns the newest row as a dict by reading only the file tail."""
+        rows = self.tail(1)
+        return rows[-1] if rows else None
+
+    def tail(self, n):
+        """Returns up to the n newest rows as dicts (oldest first), reading only the file tail."""
+        if not os.path.exists(self.path):
+            return []
+        import csv
+        with open(self.path, 'rb') as f:
+            header = f.readline()
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(len(header), size - 65536))
+            tail = f.read().splitlines()
+        lines = [line for line in tail if line.strip()][-n:]
+        if not lines:
+            return []
+        names = next(csv.reader([header.decode('utf-8')]))
+        return [dict(zip(names, values)) for values in csv.reader(line.decode('utf-8') for line in lines)]
+
+    def replace(self, df):
+        """Rewrites the whole file from df (atomic rename)."""
+        tmp = self.path + ".tmp"
+        out = df[HISTORY_COLUMNS].copy()
+        out['timestamp'] = pd.to_datetime(out['timestamp']).dt.strftime("%Y-%m-%d %H:%M:%S")
+        out.to_csv(tmp, index=False)
+        with open(tmp, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+class SQLiteHistoryStore:
+    """
+    SQLite backend indexed by timestamp, so period queries only read the
+    rows inside the requested range. Timestamps are stored as integer
+    seconds (naive local time, same as the CSV strings).
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history (
+            ts INTEGER NOT NULL,
+            bullion_sell REAL,
+            bullion_buy REAL,
+            ornament_sell REAL,
+            tax_base REAL,
+            update_time TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_history_ts ON history (ts);
+    """
+    UNIQUE_INDEX = (
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_history_key "
+        "ON history (update_time, bullion_sell, bullion_buy, ornament_sell, tax_base)"
+    )
+
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            conn.executescript(SQLiteHistoryStore.SCHEMA)
+        self.ensure_unique_index()
+
+    def ensure_unique_index(self):
+        """Lets the database reject duplicate snapshots from concurrent workers."""
+        import sqlite3
+        try:
+            with self.connect() as conn:
+                conn.execute(SQLiteHistoryStore.UNIQUE_INDEX)
+        except sqlite3.IntegrityError:
+            print("History has duplicate snapshots; run `python tools.py compact`")
+
+    def connect(self):
+        import sqlite3
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def append(self, rows, durable=False):
+        """
+        Inserts rows in one transaction, skipping duplicate snapshots.
+        Commits are already fsynced (synchronous=FULL), so durable is
+        accepted for parity with CSVHistoryStore.
+        """
+        with self.connect() as conn:
+            return self._insert(conn, rows)
+
+    @staticmethod
+    def _insert(conn, rows):
+        """Inserts rows on conn inside its open transaction. Returns rows actually inserted."""
+        df = pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+        if df.empty:
+            return 0
+        columns = [to_epoch(df['timestamp']).tolist()]
+        for col in HISTORY_COLUMNS[:-1]:
+            values = df[col].astype(object)
+            columns.append(values.where(values.notna(), None).tolist())
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO history (ts, bullion_sell, bullion_buy, ornament_sell, tax_base, update_time) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            zip(*columns)
+        )
+        return conn.total_changes - before
+
+    def load(self, start=None, end=None):
+        query = "SELECT ts, " + ", ".join(HISTORY_COLUMNS[:-1]) + " FROM history"
+        clauses, params = [], []
+        # Rows are whole seconds, so sub-second bounds round up to match the CSV backend
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(int(to_epoch([start], ceil=True).iloc[0]))
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(int(to_epoch([end], ceil=True).iloc[0]))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY ts"
+        with self.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        if not rows:
+            return pd.DataFrame(columns=HISTORY_COLUMNS)
+        # Column-wise construction is much cheaper than from_records on large ranges
+        ts, *values = zip(*rows)
+        df = pd.DataFrame({col: values[i] for i, col in enumerate(HISTORY_COLUMNS[:-1])})
+        df[PRICE_COLUMNS] = df[PRICE_COLUMNS].astype('float64')
+        df['timestamp'] = pd.to_datetime(pd.Series(ts, dtype='int64'), unit='s')
+        return df
+
+    def last(self):
+        rows = self.tail(1)
+        return rows[-1] if rows else None
+
+    def tail(self, n):
+        """Returns up to the n newest rows as dicts, oldest first."""
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT ts, " + ", ".join(HISTORY_COLUMNS[:-1]) +
+                " FROM history ORDER BY ts DESC, rowid DESC LIMIT ?", (n,)
+            ).fetchall()
+        rows.reverse()
+        stamps = pd.to_datetime([row[0] for row in rows], unit='s')
+        return [dict(zip(HISTORY_COLUMNS[:-1], row[1:]), timestamp=ts) for row, ts in zip(rows, stamps)]
+
+    def replace(self, df):
+        """Rewrites the whole table from df in one transaction."""
+        with self.connect() as conn:
+            conn.execute("DELETE FROM history")
+            self._insert(conn, df[HISTORY_COLUMNS].to_dict('records'))
+        self.ensure_unique_index()
+
+class FileLock:
+    """
+    Exclusive lock on a side file, held across processes (POSIX lockf; on
+    NFS only as reliable as the server's lock manager) and across threads of
+    this process. Falls back to the thread lock alone where fcntl is
+    unavailable (Windows). Readers do not take it; see SQLITE_JOURNAL_MODE.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        except Exception:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            import fcntl
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+class HistoryWriter:
+    """
+    Single ingestion path for a history store, safe across threads and
+    processes. Callers queue snapshots; whichever finds no commit running
+    becomes the leader and writes everything queued so far as one group
+    commit: take the file lock, drop snapshots already among the newest
+    stored rows, append the rest in one write, fsync, release. The other
+    callers just wait for their snapshot's result.
+    """
+    DEDUP_WINDOW = 50 # Newest stored rows a snapshot is checked against
+
+    def __init__(self, store, lock_path, on_write=None):
+        self.store = store
+        self.lock = FileLock(lock_path)
+        self.on_write = on_write # on_write(rows) runs under the lock after each commit
+        self.commits = 0
+        self._stored = set() # Keys known to be stored; repeats skip the lock entirely
+        self._pending = []
+        self._leader = False
+        self._cond = threading.Lock()
+
+    def submit(self, row):
+        """Queues row and blocks until it is committed. Returns True if it was written."""
+        from concurrent.futures import Future
+        if DataManager.snapshot_key(row) in self._stored:
+            return False
+        future = Future()
+        with self._cond:
+            self._pending.append((row, future))
+            lead = not self._leader
+            self._leader = True
+        if lead:
+            self._drain()
+        return future.result()
+
+    def _drain(self):
+        while True:
+            with self._cond:
+                batch, self._pending = self._pending, []
+                if not batch:
+                    self._leader = False
+                    return
+            try:
+                written = self._commit([row for row, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), ok in zip(batch, written):
+                    future.set_result(ok)
+
+    def _commit(self, rows):
+        with self.lock:
+            seen = {DataManager.snapshot_key(r) for r in self.store.tail(HistoryWriter.DEDUP_WINDOW)}
+            written, fresh = [], []
+            for row in rows:
+                key = DataManager.snapshot_key(row)
+                written.append(key not in seen)
+                if key not in seen:
+                    seen.add(key)
+                    fresh.append(row)
+            if fresh:
+                if self.store.append(fresh, durable=True) == 0:
+                    written = [False] * len(rows)
+                else:
+                    self.commits += 1
+                    if self.on_write:
+                        self.on_write(fresh)
+        self._stored = seen
+        return written
+
+class RollupStore:
+    """
+    Hourly/daily/weekly OHLC candles for every price column, kept in SQLite
+    and updated with one upsert per level as each snapshot arrives.
+    Long-range chart queries read a few hundred candles instead of raw ticks.
+    """
+    # Bucket width and alignment offset in seconds (weeks start on Monday)
+    LEVELS = {
+        "hour": (3600, 0),
+        "day": (86400, 0),
+        "week": (7 * 86400, 4 * 86400),
+    }
+    OHLC = ["open", "high", "low", "close"]
+
+    def __init__(self, path):
+        self.path = path
+        cols = ", ".join(f"{c}_{p} REAL" for c in PRICE_COLUMNS for p in RollupStore.OHLC)
+        with self.connect() as conn:
+            conn.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS rollups (level TEXT NOT NULL, bucket INTEGER NOT NULL, "
+                f"n INTEGER NOT NULL, {cols}, PRIMARY KEY (level, bucket)) WITHOUT ROWID"
+            )
+
+    def connect(self):
+        import sqlite3
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def bucket(ts, level):
+        width, offset = RollupStore.LEVELS[level]
+        return ts - (ts - offset) % width
+
+    def update(self, row):
+        """Folds one snapshot (in time order) into every level."""
+        ts = int(to_epoch([row['timestamp']]).iloc[0])
+        prices = []
+        for col in PRICE_COLUMNS:
+            value = row.get(col)
+            prices.append(None if value is None or pd.isna(value) else float(value))
+
+        names = [f"{c}_{p}" for c in PRICE_COLUMNS for p in RollupStore.OHLC]
+        sets = []
+        for c in PRICE_COLUMNS:
+            sets += [
+                f"{c}_open = coalesce({c}_open, excluded.{c}_open)",
+                f"{c}_high = max(coalesce({c}_high, excluded.{c}_high), coalesce(excluded.{c}_high, {c}_high))",
+                f"{c}_low = min(coalesce({c}_low, excluded.{c}_low), coalesce(excluded.{c}_low, {c}_low))",
+                f"{c}_close = coalesce(excluded.{c}_close, {c}_close)",
+            ]
+        sql = (
+            f"INSERT INTO rollups (level, bucket, n, {', '.join(names)}) "
+            f"VALUES (?, ?, 1, {', '.join('?' * len(names))}) "
+            f"ON CONFLICT (level, bucket) DO UPDATE SET n = n + 1, {', '.join(sets)}"
+        )
+        values = [p for p in prices for _ in RollupStore.OHLC]
+        with self.connect() as conn:
+            conn.executemany(sql, [
+                [level, RollupStore.bucket(ts, level)] + values for level in RollupStore.LEVELS
+            ])
+
+    def rebuild(self, history):
+        """Recomputes every level from a full history frame in one vectorized pass."""
+        with self.connect() as conn:
+            conn.execute("DELETE FROM rollups")
+            if history.empty:
+                return
+            ts = to_epoch(history['timestamp'].reset_index(drop=True))
+            order = ts.argsort(kind='stable')
+            ts = ts.iloc[order].reset_index(drop=True)
+            prices = history[PRICE_COLUMNS].reset_index(drop=True).iloc[order].reset_index(drop=True)
+            for level in RollupStore.LEVELS:
+                buckets = RollupStore.bucket(ts, level)
+                grouped = prices.groupby(buckets.values)
+                frames = {"n": grouped.size()}
+                for col in PRICE_COLUMNS:
+                    g = grouped[col]
+                    frames[f"{col}_open"] = g.first()
+                    frames[f"{col}_high"] = g.max()
+                    frames[f"{col}_low"] = g.min()
+                    frames[f"{col}_close"] = g.last()
+                out = pd.DataFrame(frames)
+                out = out.astype(object).where(out.notna(), None)
+                names = list(out.columns)
+                conn.executemany(
+                    f"INSERT INTO rollups (level, bucket, {', '.join(names)}) "
+                    f"VALUES (?, ?, {', '.join('?' * len(names))})",
+                    ([level, int(b)] + list(vals) for b, vals in zip(out.index, out.itertuples(index=False, name=None)))
+                )
+
+    def load(self, level, start=None, end=None):
+        """
+        Returns candles for level with start <= bucket < end. Plain price
+        columns hold the close so charts can treat candles like raw rows.
+        """
+        query = "SELECT * FROM rollups WHERE level = ?"
+        params = [level]
+        if start is not None:
+            query += " AND bucket >= ?"
+            params.append(RollupStore.bucket(int(to_epoch([start]).iloc[0]), level))
+        if end is not None:
+            query += " AND bucket < ?"
+            params.append(int(to_epoch([end]).iloc[0]))
+        with self.connect() as conn:
+            cur = conn.execute(query + " ORDER BY bucket", params)
+            names = [d[0] for d in cur.description]
+            df = pd.DataFrame(cur.fetchall(), columns=names)
+        df['timestamp'] = pd.to_datetime(df.pop('bucket').astype('int64'), unit='s')
+        df = df.drop(columns='level')
+        for col in PRICE_COLUMNS:
+            df[col] = df[f"{col}_close"].astype('float64')
+        return df
+
+    def high_before(self, ts, col='bullion_sell'):
+        """Highest col price in hourly candles that closed at or before ts; None if none."""
+        end = int(to_epoch([ts]).iloc[0]) - RollupStore.LEVELS["hour"][0]
+        with self.connect() as conn:
+            row = conn.execute(f"SELECT max({col}_high) FROM rollups WHERE level = 'hour' AND bucket <= ?",
+                               (end,)).fetchone()
+        return row[0]
+
+    def count(self, start=None, end=None):
+        """Raw snapshots in the hourly candles overlapping [start, end): a cheap upper bound on row count."""
+        query, params = "SELECT coalesce(sum(n), 0) FROM rollups WHERE level = 'hour'", []
+        if start is not None:
+            query += " AND bucket >= ?"
+            params.append(RollupStore.bucket(int(to_epoch([start]).iloc[0]), "hour"))
+        if end is not None:
+            query += " AND bucket < ?"
+            params.append(int(to_epoch([end], ceil=True).iloc[0]))
+        with self.connect() as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+    def first_bucket(self):
+        with self.connect() as conn:
+            row = conn.execute("SELECT min(bucket) FROM rollups WHERE level = 'hour'").fetchone()
+        return None if row[0] is None else pd.to_datetime(row[0], unit='s')
+
 class DataManager:
     HISTORY_FILE = "gold_history.csv"
+    HISTORY_DB = "gold_history.db"
+    # "sqlite" (default) or "csv"
+    BACKEND = os.environ.get("GOLD_HISTORY_BACKEND", "sqlite")
+    ROLLUP_DB = "gold_rollups.db"
+    PERIOD_DAYS = {"1W": 7, "1M": 30, "1Y": 365, "3Y": 365 * 3}
+    # Chart periods use the coarsest rollup that still yields this many points
+    CHART_MIN_POINTS = 120
+    _stores = {}
+    _writers = {}
+    _rollups = None
+    _indicators = None
+    _indicators_lock = threading.Lock()
+    # More new rows than this since the checkpoint: rebuild in one vectorized pass instead
+    INDICATOR_REBUILD_ROWS = 10_000
+
+    @staticmethod
+    def get_store(backend=None):
+        """Returns the history store for the configured backend (one per process)."""
+        backend = backend or DataManager.BACKEND
+        path = DataManager.HISTORY_DB if backend == "sqlite" else DataManager.HISTORY_FILE
+        key = (backend, path)
+        if key not in DataManager._stores:
+            if backend == "sqlite":
+                is_new = not os.path.exists(path)
+                store = SQLiteHistoryStore(path)
+                if is_new and os.path.exists(DataManager.HISTORY_FILE):
+                    # One-shot migration of the legacy CSV on first use
+                    DataManager.migrate_csv(DataManager.HISTORY_FILE, store)
+            else:
+                store = CSVHistoryStore(path)
+            DataManager._stores[key] = store
+        return DataManager._stores[key]
+
+    @staticmethod
+    def get_writer(backend=None):
+        """Returns the group-commit writer for the configured store (one per process)."""
+        store = DataManager.get_store(backend)
+        path = store.path
+        if path not in DataManager._writers:
+            def update_rollups(rows):
+                if DataManager._rollups is None and DataManager._open_rollups():
+                    return # Just rebuilt from a history that already holds rows
+                for row in rows:
+                    DataManager._rollups.update(row)
+            DataManager._writers[path] = HistoryWriter(store, path + ".lock", on_write=update_rollups)
+        return DataManager._writers[path]
+
+    @staticmethod
+    def get_rollups():
+        """Returns the OHLC rollup store, building it from history on first use."""
+        if DataManager._rollups is None:
+            DataManager._open_rollups()
+        return DataManager._rollups
+
+    @staticmethod
+    def _open_rollups():
+        """Opens the rollup store; returns True if it was just rebuilt from history."""
+        is_new = not os.path.exists(DataManager.ROLLUP_DB)
+        rollups = RollupStore(DataManager.ROLLUP_DB)
+        if is_new:
+            rollups.rebuild(DataManager.load_history())
+        DataManager._rollups = rollups
+        return is_new
+
+    @staticmethod
+    def migrate_csv(csv_path, store, chunksize=200_000):
+        """Copies a legacy history CSV into store in chunks. Returns the number of rows inserted."""
+        total = 0
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            total += store.append(chunk.reindex(columns=HISTORY_COLUMNS).to_dict('records'))
+        print(f"Migrated {total} history rows from {csv_path}")
+        return total
 
     @staticmethod
+    def snapshot_key(row):
+        """Dedup key of a snapshot: (update_time, prices...), NaN-safe."""
+        key = []
+        for col in DEDUP_KEY:
+            value = row.get(col) if row else None
+            if value is None or (isinstance(value, float) and value != value) or value == '':
+                key.append(None)
+            elif col == 'update_time':
+                key.append(str(value))
+            else:
+                key.append(float(value))
+        return tuple(key)
+
+    @staticmethod
+    @Metrics.timed("history.save_snapshot")
     def save_snapshot(data):
-        """Saves a price snapshot to CSV."""
-        df = pd.DataFrame([data])
-        df['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        if not os.path.exists(DataManager.HISTORY_FILE):
-            df.to_csv(DataManager.HISTORY_FILE, index=False)
-        else:
-            df.to_csv(DataManager.HISTORY_FILE, mode='a', header=False, index=False)
+        """
+        Saves a price snapshot to the history store unless it repeats a
+        recently stored announcement. Safe to call from several threads,
+        processes or replicas sharing one volume. Returns True if a row was
+        written.
+        """
+        row = {col: data.get(col) for col in HISTORY_COLUMNS[:-1]}
+        row['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return DataManager.get_writer().submit(row)
 
     @staticmethod
-    def load_history():
-        """Loads historical data from CSV."""
-        if not os.path.exists(DataManager.HISTORY_FILE):
-            return pd.DataFrame()
-        df = pd.read_csv(DataManager.HISTORY_FILE)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        return df
+    def compact():
+        """
+        Rewrites history sorted by time without duplicate snapshots, keeping
+        the first occurrence of each key. Returns (rows_before, rows_after).
+        """
+        # Hold the history lock so no replica appends between the read and the rewrite
+        with DataManager.get_writer().lock:
+            df = DataManager.load_history()
+            before = len(df)
+            df = df.sort_values('timestamp', kind='stable')
+            df = df[~df.duplicated(subset=DEDUP_KEY, keep='first')]
+            DataManager.get_store().replace(df)
+            DataManager.get_rollups().rebuild(df)
+            with DataManager._indicators_lock:
+                DataManager._indicators = IndicatorEngine.rebuild(df)
+                DataManager._indicators.save()
+        return before, len(df)
 
     @staticmethod
-    def filter_history(df, period):
-        """Filters historical data based on period: 7d, 30d, 1y, 3y, All."""
-        if df.empty or 'timestamp' not in df.columns:
+    @Metrics.timed("history.load_history")
+    def load_history(start=None, end=None):
+        """
+        Loads historical data sorted by time with a DatetimeIndex, optionally
+        only rows with start <= timestamp < end.
+        """
+        df = DataManager.get_store().load(start, end)
+        if df.empty:
             return df
-        
+        return index_by_time(df)
+
+    @staticmethod
+    def load_period(period):
+        """Loads only the rows needed for a period code (1W, 1M, 1Y, 3Y, All)."""
+        days = DataManager.PERIOD_DAYS.get(period)
+        if days is None:
+            return DataManager.load_history()
+        from datetime import timedelta
+        return DataManager.load_history(start=datetime.now() - timedelta(days=days))
+
+    @staticmethod
+    def history_for_chart(period, min_points=None):
+        """
+        Returns (level, df) for a chart period, where level is the coarsest
+        rollup ("week", "day", "hour") giving at least min_points candles,
+        or "raw" when only raw snapshots are dense enough.
+        """
         from datetime import timedelta
+        min_points = min_points or DataManager.CHART_MIN_POINTS
+        rollups = DataManager.get_rollups()
         now = datetime.now()
+        days = DataManager.PERIOD_DAYS.get(period)
+        first = rollups.first_bucket()
+        if first is None:
+            return "raw", DataManager.load_history()
+        start = now - timedelta(days=days) if days else first
+
+        # Density is judged on the part of the period we actually have data for
+        span = (now - max(start, first)).total_seconds()
+        for level in ["week", "day", "hour"]:
+            width, _ = RollupStore.LEVELS[level]
+            if span / width >= min_points:
+                return level, rollups.load(level, start=start)
+        return "raw", DataManager.load_history(start=start)
+
+    @staticmethod
+    def history_for_range(start=None, end=None, max_rows=5000):
+        """
+        Returns (level, df) for explicit bounds: raw rows when the range holds
+        at most max_rows snapshots, else the finest rollup level with at most
+        max_rows candles (weekly candles at the most), so wide ranges stay small.
+        """
+        rollups = DataManager.get_rollups()
+        if rollups.count(start, end) <= max_rows:
+            return "raw", DataManager.load_history(start=start, end=end)
+        first = rollups.first_bucket()
+        lo = max(pd.Timestamp(start), first) if start is not None else first
+        hi = pd.Timestamp(end) if end is not None else pd.Timestamp.now()
+        span = max((hi - lo).total_seconds(), 0)
+        for level in ["hour", "day", "week"]:
+            width, _ = RollupStore.LEVELS[level]
+            if span / width <= max_rows or level == "week":
+                return level, rollups.load(level, start=start, end=end)
+
+    @staticmethod
+    def indicators():
+        """
+        Latest indicator values for the stored history. The engine resumes
+        from its checkpoint and folds in only snapshots stored since (by
+        any process), so a call costs one small range query.
+        """
+        with DataManager._indicators_lock:
+            engine = DataManager._indicators or IndicatorEngine.load()
+            last = DataManager.get_store().last()
+            last_ts = pd.Timestamp(last['timestamp']) if last else None
+            if engine is not None and engine.last_ts is not None and (last_ts is None or engine.last_ts > last_ts):
+                engine = None # Checkpoint is ahead of the store: history was replaced
+            if engine is None or engine.count == 0:
+                engine = IndicatorEngine.rebuild(DataManager.load_history())
+                engine.save()
+            elif last_ts is not None and last_ts >= engine.last_ts:
+                new = DataManager.load_history(start=engine.last_ts).iloc[engine.at_last_ts:]
+                if len(new) > DataManager.INDICATOR_REBUILD_ROWS:
+                    engine = IndicatorEngine.rebuild(DataManager.load_history())
+                else:
+                    for row in new.to_dict('records'):
+                        engine.update(row)
+                if len(new):
+                    engine.save()
+            DataManager._indicators = engine
+            return engine.values()
+
+    @staticmethod
+    def indicator_series(period):
+        """(level, df) like history_for_chart, with IndicatorEngine.compute columns added."""
+        level, df = DataManager.history_for_chart(period)
+        if df.empty:
+            return level, df
+        df = df.reset_index(drop=True)
+        peak = DataManager.get_rollups().high_before(df['timestamp'].iloc[0])
+        return level, df.join(IndicatorEngine.compute(df, peak=peak))
+
+    @staticmethod
+    def filter_history(df, period=None, start=None, end=None):
+        """
+        Filters historical data to a period code (1W, 1M, 1Y, 3Y, All) or to
+        explicit start/end bounds (start inclusive, end exclusive).
+        Uses a binary search on the sorted timestamp index, so the cost does
+        not grow with the number of rows outside the window.
+        """
+        if df.empty or 'timestamp' not in df.columns:
+            return df
         
-        if period == "1W":
-            return df[df['timestamp'] > now - timedelta(days=7)]
-        elif period == "1M":
-            return df[df['timestamp'] > now - timedelta(days=30)]
-        elif period == "1Y":
-            return df[df['timestamp'] > now - timedelta(days=365)]
-        elif period == "3Y":
-            return df[df['timestamp'] > now - timedelta(days=365*3)]
-        return df # Default: Max/All
+        from datetime import timedelta
+        days = DataManager.PERIOD_DAYS.get(period)
+        if days is not None:
+            start = datetime.now() - timedelta(days=days)
+        return slice_by_time(df, start, end)
+
+class PortfolioEngine:
+    """
+    Values many purchase lots at once. A lot is one row of a DataFrame with
+    type ("bullion"/"ornament"), buy_date, buy_price (THB per baht),
+    amount (baht) and optional fee (THB, added to the cost).
+    """
+    # Lots are marked at the GTA price the shop would sell at, as in the P&L calculator
+    PRICE_FIELD = {"bullion": "bullion_sell", "ornament": "ornament_sell"}
+
+    @staticmethod
+    def _normalize(lots):
+        lots = lots.copy()
+        lots['type'] = lots['type'].fillna("bullion").astype(str).str.lower()
+        lots['buy_date'] = pd.to_datetime(lots['buy_date']).dt.normalize()
+        lots['fee'] = lots['fee'].fillna(0.0) if 'fee' in lots.columns else 0.0
+        lots['cost'] = lots['buy_price'] * lots['amount'] + lots['fee']
+        return lots
+
+    @staticmethod
+    def annualize(roi_pct, days):
+        """Compounds a total return (%) over days into a yearly rate (%)."""
+        days = np.maximum(np.asarray(days, dtype='float64'), 1)
+        return ((1 + np.asarray(roi_pct, dtype='float64') / 100) ** (365 / days) - 1) * 100
+
+    @staticmethod
+    def evaluate(lots, prices, today=None):
+        """
+        Returns (per_lot, totals). per_lot adds cost, current_value, pnl,
+        roi and annual_roi columns; totals aggregates the whole portfolio,
+        annualized over the cost-weighted holding period.
+        """
+        lots = PortfolioEngine._normalize(lots)
+        today = pd.Timestamp(today or datetime.now()).normalize()
+        price = lots['type'].map({k: prices[f] for k, f in PortfolioEngine.PRICE_FIELD.items()})
+
+        lots['current_value'] = price * lots['amount']
+        lots['pnl'] = lots['current_value'] - lots['cost']
+        lots['roi'] = np.where(lots['cost'] > 0, lots['pnl'] / lots['cost'].where(lots['cost'] > 0) * 100, 0.0)
+        lots['days'] = np.maximum((today - lots['buy_date']).dt.days, 1)
+        lots['annual_roi'] = PortfolioEngine.annualize(lots['roi'], lots['days'])
+
+        cost = float(lots['cost'].sum())
+        value = float(lots['current_value'].sum())
+        roi = (value - cost) / cost * 100 if cost > 0 else 0.0
+        days = (lots['days'] * lots['cost']).sum() / cost if cost > 0 else 1
+        totals = {
+            "cost": cost,
+            "current_value": value,
+            "pnl": value - cost,
+            "roi": roi,
+            "annual_roi": float(PortfolioEngine.annualize(roi, days)),
+        }
+        return lots, totals
+
+    @staticmethod
+    def equity_curve(lots, daily_prices=None):
+        """
+        Daily mark-to-market of the portfolio from its first buy date.
+        daily_prices: frame indexed by day with bullion_sell/ornament_sell;
+        defaults to the daily closes in the rollup store.
+        Returns a frame indexed by day with cost, value and pnl.
+        """
+        lots = PortfolioEngine._normalize(lots)
+        if lots.empty:
+            return pd.DataFrame(columns=["cost", "value", "pnl"])
+        start = lots['buy_date'].min()
+        if daily_prices is None:
+            daily_prices = DataManager.get_rollups().load("day", start=start).set_index('timestamp')
+        days = pd.date_range(start, pd.Timestamp(datetime.now()).normalize(), freq='D')
+        closes = daily_prices.reindex(days, method='ffill')
+
+        # Baht held per type and cumulative cost per day: one pivot + cumsum, not a loop over lots
+        held = (lots.pivot_table(index='buy_date', columns='type', values='amount', aggfunc='sum')
+                .reindex(days, fill_value=0).fillna(0).cumsum())
+        cost = lots.groupby('buy_date')['cost'].sum().reindex(days, fill_value=0).cumsum()
+
+        value = pd.Series(0.0, index=days)
+        for kind, field in PortfolioEngine.PRICE_FIELD.items():
+            if kind in held.columns:
+                value = value + held[kind] * closes[field]
+        curve = pd.DataFrame({"cost": cost, "value": value})
+        curve['pnl'] = curve['value'] - curve['cost']
+        return curve
+
+class IndicatorEngine:
+    """
+    Rolling indicators over the bullion_sell snapshot stream: short/long
+    moving averages, volatility of snapshot-to-snapshot log returns,
+    drawdown from the all-time peak and the bullion-ornament spread.
+    update() is O(1) per snapshot (fixed windows plus running sums); the
+    whole state is a few dozen numbers, checkpointed as JSON. compute()
+    gives the same statistics for a frame in one vectorized pass.
+    """
+    SHORT = 20 # Snapshots (or chart bars) in the short moving average
+    LONG = 50
+    VOL_WINDOW = 20
+    STATE_FILE = "gold_indicators.json"
+
+    def __init__(self, short=None, long=None, vol_window=None):
+        self.short = short or IndicatorEngine.SHORT
+        self.long = max(long or IndicatorEngine.LONG, self.short)
+        self.vol_window = vol_window or IndicatorEngine.VOL_WINDOW
+        self.reset()
+
+    def reset(self):
+        from collections import deque
+        self.count = 0
+        self.last_ts = None # Timestamp of the newest snapshot folded in
+        self.at_last_ts = 0 # How many snapshots share last_ts (second resolution)
+        self.prices = deque(maxlen=self.long)
+        self.returns = deque(maxlen=self.vol_window)
+        self.sum_short = self.sum_long = 0.0
+        self.ret_sum = self.ret_sumsq = 0.0
+        self.peak = None
+        self.spread = None
+
+    def update(self, row):
+        """Folds one snapshot (in time order) into the state; returns values()."""
+        price = row.get('bullion_sell')
+        if price is None or pd.isna(price):
+            return self.values()
+        price = float(price)
+        prices = self.prices
+        if prices:
+            r = float(np.log(price / prices[-1]))
+            if len(self.returns) == self.vol_window:
+                old = self.returns[0]
+                self.ret_sum -= old
+                self.ret_sumsq -= old * old
+            self.returns.append(r)
+            self.ret_sum += r
+            self.ret_sumsq += r * r
+        if len(prices) >= self.short:
+            self.sum_short -= prices[-self.short]
+        if len(prices) == self.long:
+            self.sum_long -= prices[0]
+        prices.append(price)
+        self.sum_short += price
+        self.sum_long += price
+        self.peak = price if self.peak is None else max(self.peak, price)
+        ornament = row.get('ornament_sell')
+        if ornament is not None and not pd.isna(ornament):
+            self.spread = float(ornament) - price
+
+        ts = pd.Timestamp(row['timestamp']) if row.get('timestamp') is not None else None
+        self.at_last_ts = self.at_last_ts + 1 if ts is not None and ts == self.last_ts else 1
+        self.last_ts = ts
+        self.count += 1
+        return self.values()
+
+    def values(self):
+        """Latest indicator values; None until there is data for them."""
+        n, k = len(self.prices), len(self.returns)
+        if not n:
+            return {"ma_short": None, "ma_long": None, "volatility": None, "drawdown": None,
+                    "spread": None, "count": 0, "as_of": None}
+        volatility = None
+        if k > 1:
+            variance = (self.ret_sumsq - self.ret_sum ** 2 / k) / (k - 1)
+            volatility = float(np.sqrt(max(variance, 0.0))) * 100
+        return {
+            "ma_short": self.sum_short / min(n, self.short),
+            "ma_long": self.sum_long / n,
+            "volatility": volatility, # % std of log returns over the last VOL_WINDOW snapshots
+            "drawdown": (self.prices[-1] / self.peak - 1) * 100, # % below the all-time peak
+            "spread": self.spread,
+            "count": self.count,
+            "as_of": str(self.last_ts) if self.last_ts is not None else None,
+        }
+
+    def state(self):
+        return {
+            "windows": [self.short, self.long, self.vol_window],
+            "count": self.count, "last_ts": str(self.last_ts) if self.last_ts is not None else None,
+            "at_last_ts": self.at_last_ts, "prices": list(self.prices), "returns": list(self.returns),
+            "peak": self.peak, "spread": self.spread,
+        }
+
+    @staticmethod
+    def from_state(state):
+        engine = IndicatorEngine(*state["windows"])
+        engine.count = state["count"]
+        engine.last_ts = pd.Timestamp(state["last_ts"]) if state["last_ts"] else None
+        engine.at_last_ts = state["at_last_ts"]
+        engine.prices.extend(state["prices"])
+        engine.returns.extend(state["returns"])
+        engine.peak = state["peak"]
+        engine.spread = state["spread"]
+        engine._resum()
+        return engine
+
+    def _resum(self):
+        """Recomputes the running sums from the windows (also clears float drift)."""
+        prices = list(self.prices)
+        self.sum_long = float(sum(prices))
+        self.sum_short = float(sum(prices[-self.short:]))
+        self.ret_sum = float(sum(self.returns))
+        self.ret_sumsq = float(sum(r * r for r in self.returns))
+
+    def save(self, path=None):
+        """Writes the checkpoint atomically; replicas saving at once each use their own temp file."""
+        import json
+        import tempfile
+        path = path or IndicatorEngine.STATE_FILE
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.state(), f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @staticmethod
+    def load(path=None):
+        """Engine from a checkpoint, or None if there is none (or it is unreadable)."""
+        import json
+        path = path or IndicatorEngine.STATE_FILE
+        try:
+            with open(path) as f:
+                return IndicatorEngine.from_state(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @staticmethod
+    def rebuild(history, **windows):
+        """Engine state for a whole history frame in one vectorized pass."""
+        engine = IndicatorEngine(**windows)
+        df = history.dropna(subset=['bullion_sell'])
+        if df.empty:
+            return engine
+        prices = df['bullion_sell'].to_numpy(dtype='float64')
+        engine.count = len(prices)
+        engine.prices.extend(prices[-engine.long:].tolist())
+        engine.returns.extend(np.diff(np.log(prices[-(engine.vol_window + 1):])).tolist())
+        engine.peak = float(prices.max())
+        spread = (df['ornament_sell'] - df['bullion_sell']).dropna()
+        engine.spread = float(spread.iloc[-1]) if not spread.empty else None
+        ts = pd.to_datetime(df['timestamp'])
+        engine.last_ts = ts.iloc[-1]
+        engine.at_last_ts = int((ts == engine.last_ts).sum())
+        engine._resum()
+        return engine
+
+    @staticmethod
+    def compute(df, short=None, long=None, vol_window=None, peak=None):
+        """
+        Indicator series for a frame of snapshots or candles (windows count
+        rows, so on a daily chart ma_short is a 20-day average). peak is the
+        high before the frame, so drawdown is measured against all history.
+        """
+        short = short or IndicatorEngine.SHORT
+        long = long or IndicatorEngine.LONG
+        vol_window = vol_window or IndicatorEngine.VOL_WINDOW
+        price = df['bullion_sell'].astype('float64')
+        running_peak = price.cummax()
+        if peak is not None:
+            running_peak = running_peak.clip(lower=peak)
+        return pd.DataFrame({
+            "ma_short": price.rolling(short, min_periods=1).mean(),
+            "ma_long": price.rolling(long, min_periods=1).mean(),
+            "volatility": np.log(price).diff().rolling(vol_window, min_periods=2).std() * 100,
+            "drawdown": (price / running_peak - 1) * 100,
+            "spread": df['ornament_sell'].astype('float64') - price,
+        }, index=df.index)
 
 class AlertManager:
+    """
+    Shared, persistent price-alert registry.
+    Pending thresholds are kept in two heaps: ABOVE keyed by target (lowest
+    first) and BELOW by -target (highest first), so a new price pops exactly
+    the crossed alerts: O((k + 1) log n) per tick, O(log n) per add. Removed
+    alerts are dropped lazily when they reach the top. Alerts are one-shot
+    and stored in SQLite, so they survive restarts and fire from the poller
+    even when no page is open; a row is claimed with a conditional UPDATE,
+    so replicas sharing alerts.db never fire the same alert twice.
+    """
+    STORE_FILE = "alerts.db"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS alerts (
+            id TEXT PRIMARY KEY,
+            target REAL NOT NULL,
+            condition TEXT NOT NULL,
+            subscriber TEXT,
+            created_at TEXT NOT NULL,
+            fired_at TEXT,
+            fired_price REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_alerts_pending ON alerts (fired_at);
+    """
+
+    def __init__(self, path=None):
+        self.path = path or AlertManager.STORE_FILE
+        self._lock = threading.Lock()
+        self._alerts = {} # id -> alert dict
+        self._pending = set() # ids still waiting to fire; heap entries not in here are stale
+        self._above, self._below = [], [] # heaps of (key, id)
+        self._listeners = []
+        self.last_price = None
+        with self.connect() as conn:
+            conn.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            conn.executescript(AlertManager.SCHEMA)
+        self._load()
+
+    def connect(self):
+        import sqlite3
+        conn = sqlite3.connect(self.path, timeout=30)
+        # WAL (or rollback journal on shared volumes) + NORMAL: durable across app crashes, no fsync per alert
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _load(self):
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT id, target, condition, subscriber, created_at, fired_at, fired_price FROM alerts"
+            ).fetchall()
+        keys = ["id", "target", "condition", "subscriber", "created_at", "fired_at", "fired_price"]
+        for row in rows:
+            alert = dict(zip(keys, row))
+            self._alerts[alert['id']] = alert
+            if alert['fired_at'] is None:
+                self._pending.add(alert['id'])
+        self._heapify()
+
+    def _heapify(self):
+        """Rebuilds both heaps from the pending alerts, dropping stale entries."""
+        import heapq
+        self._above = [(self._alerts[i]['target'], i) for i in self._pending if self._alerts[i]['condition'] == "ABOVE"]
+        self._below = [(-self._alerts[i]['target'], i) for i in self._pending if self._alerts[i]['condition'] == "BELOW"]
+        heapq.heapify(self._above)
+        heapq.heapify(self._below)
+
+    def subscribe(self, callback):
+        """callback(fired_alerts) is called after every tick that fires alerts."""
+        self._listeners.append(callback)
+
+    def attach(self, poller):
+        """Checks alerts on every snapshot poller publishes, whether or not a page is open."""
+        poller.subscribe(lambda snap: self.process(snap['prices']['bullion_sell']) if snap['prices'] else None)
+        return self
+
+    def add(self, target, condition, subscriber=None):
+        """Registers a one-shot alert and returns its id."""
+        import heapq
+        import uuid
+        condition = condition.upper()
+        if condition not in ("ABOVE", "BELOW"):
+            raise ValueError(f"Unknown alert condition: {condition}")
+        alert = {
+            "id": uuid.uuid4().hex, "target": float(target), "condition": condition,
+            "subscriber": subscriber, "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "fired_at": None, "fired_price": None,
+        }
+        with self._lock:
+            with self.connect() as conn:
+                conn.execute(
+                    "INSERT INTO alerts (id, target, condition, subscriber, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (alert['id'], alert['target'], condition, subscriber, alert['created_at'])
+                )
+            self._alerts[alert['id']] = alert
+            self._pending.add(alert['id'])
+            if condition == "ABOVE":
+                heapq.heappush(self._above, (alert['target'], alert['id']))
+            else:
+                heapq.heappush(self._below, (-alert['target'], alert['id']))
+        # An alert that is already satisfied fires on the current price
+        if self.last_price is not None:
+            self.process(self.last_price)
+        return alert['id']
+
+    def remove(self, alert_id):
+        with self._lock:
+            alert = self._alerts.pop(alert_id, None)
+            if alert is None:
+                return False
+            self._pending.discard(alert_id)
+            # Heap entries are dropped lazily; rebuild once they are mostly stale
+            if len(self._above) + len(self._below) > 2 * len(self._pending) + 64:
+                self._heapify()
+            with self.connect() as conn:
+                conn.execute("DELETE FROM alerts WHERE id = ?", (alert_id,))
+        return True
+
+    def process(self, price):
+        """Fires every pending alert crossed by price. Returns the fired alerts."""
+        import heapq
+        if price is None:
+            return []
+        with self._lock:
+            self.last_price = price
+            crossed = []
+            # ABOVE fires when price >= target: the lowest thresholds
+            while self._above and self._above[0][0] <= price:
+                crossed.append(heapq.heappop(self._above)[1])
+            # BELOW fires when price <= target: the highest thresholds
+            while self._below and -self._below[0][0] >= price:
+                crossed.append(heapq.heappop(self._below)[1])
+            crossed = [i for i in crossed if i in self._pending]
+            if not crossed:
+                return []
+
+            fired_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            fired = []
+            with self.connect() as conn:
+                for alert_id in crossed:
+                    self._pending.discard(alert_id)
+                    alert = self._alerts[alert_id]
+                    # Another replica may have fired (or removed) it already; only the claiming one notifies
+                    claimed = conn.execute(
+                        "UPDATE alerts SET fired_at = ?, fired_price = ? WHERE id = ? AND fired_at IS NULL",
+                        (fired_at, float(price), alert_id)
+                    ).rowcount
+                    if claimed:
+                        alert['fired_at'], alert['fired_price'] = fired_at, float(price)
+                        fired.append(dict(alert))
+                        continue
+                    row = conn.execute("SELECT fired_at, fired_price FROM alerts WHERE id = ?", (alert_id,)).fetchone()
+                    if row is None:
+                        del self._alerts[alert_id]
+                    else:
+                        alert['fired_at'], alert['fired_price'] = row
+            if not fired:
+                return []
+        for callback in self._listeners:
+            try:
+                callback(fired)
+            except Exception as e:
+                print(f"Alert listener error: {e}")
+        return fired
+
+    def status(self, alert_id):
+        alert = self._alerts.get(alert_id)
+        return dict(alert) if alert else None
+
+    def pending_count(self):
+        return len(self._pending)
+
     @staticmethod
     def check_alerts(current_price, threshold, condition):
         if condition == "ABOVE":
@@ -201,9 +2013,81 @@ class AlertManager:
         else:
             return current_price <= threshold
 
+class AssetCache:
+    """
+    Static images resized to their display width and re-encoded once, kept
+    in memory as bytes. Entries are keyed by path, mtime and width, so
+    replacing a file on disk is picked up on the next call.
+    JPEG by default: st.image passes JPEG/PNG at or below the display width
+    through untouched, while anything else (WebP included) is decoded and
+    re-encoded on every rerun. Use fmt="WEBP" for consumers outside st.image.
+    """
+    FORMAT = "JPEG"
+    QUALITY = 85
+    _cache = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def image(path, width, fmt=None):
+        """Returns encoded bytes of path at most width pixels wide, or None if the file is missing."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        fmt = fmt or AssetCache.FORMAT
+        key = (path, mtime, width, fmt)
+        data = AssetCache._cache.get(key)
+        if data is not None:
+            Metrics.incr("cache", cache="asset", result="hit")
+            return data
+        Metrics.incr("cache", cache="asset", result="miss")
+        data = AssetCache.encode(path, width, fmt)
+        with AssetCache._lock:
+            # Drop encodings of older versions of this file
+            for old in [k for k in AssetCache._cache if k[0] == path and k[1] != mtime]:
+                del AssetCache._cache[old]
+            AssetCache._cache[key] = data
+        return data
+
+    @staticmethod
+    def encode(path, width, fmt):
+        import io
+        from PIL import Image
+        with Image.open(path) as img:
+            img = img.convert("RGB")
+            if img.width > width:
+                img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+            out = io.BytesIO()
+            if fmt == "WEBP":
+                img.save(out, format=fmt, quality=AssetCache.QUALITY, method=6)
+            else:
+                img.save(out, format=fmt, quality=AssetCache.QUALITY, optimize=True)
+        return out.getvalue()
+
 class QRGenerator:
+    CACHE_SIZE = 128 # Distinct URLs kept
+
     @staticmethod
     def generate(url):
+        """Returns the QR code for url as an RGB image (a copy of the cached one)."""
+        return QRGenerator._build(url).copy()
+
+    @staticmethod
+    def generate_bytes(url, fmt="PNG"):
+        """Encoded QR image for url, built and encoded once per (url, format)."""
+        return QRGenerator._encoded(url, fmt)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def _encoded(url, fmt):
+        import io
+        out = io.BytesIO()
+        QRGenerator._build(url).save(out, format=fmt)
+        return out.getvalue()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def _build(url):
         import qrcode
         from PIL import Image
         qr = qrcode.QRCode(
@@ -217,3 +2101,147 @@ class QRGenerator:
         img = qr.make_image(fill_color="black", back_color="white")
         return img.convert('RGB')
 
+class PriceAggregator:
+    """
+    Fetches every upstream source in parallel under one global deadline,
+    so a cold fetch costs the slowest source rather than the sum of all.
+    """
+    DEADLINE = 12 # seconds for the whole batch
+    MARGIN = 1.0 # seconds of the deadline kept for parsing and fallbacks after the last upstream call
+    _executor = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def sources():
+        return {
+            "prices": ThaiGoldScraper.get_latest_prices,
+            "rates": RateManager.get_final_rates,
+        }
+
+    @staticmethod
+    def executor():
+        with PriceAggregator._lock:
+            if PriceAggregator._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                PriceAggregator._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="upstream")
+            return PriceAggregator._executor
+
+    @staticmethod
+    @Metrics.timed("upstream.fetch_all")
+    def fetch_all(deadline=None):
+        """
+        Returns {source: result, ..., "missing": [sources]}.
+        Sources that fail or miss the deadline are None and listed in "missing";
+        stragglers keep running in the pool but are not waited for.
+        """
+        from concurrent.futures import wait
+        deadline = deadline or PriceAggregator.DEADLINE
+        # Upstream calls stop retrying in time for fallbacks (e.g. last good prices) to make the deadline
+        end = time.monotonic() + deadline - PriceAggregator.MARGIN
+        futures = {name: PriceAggregator.executor().submit(PriceAggregator._within, end, fn)
+                   for name, fn in PriceAggregator.sources().items()}
+        wait(futures.values(), timeout=deadline)
+
+        results = {"missing": []}
+        for name, future in futures.items():
+            value = None
+            if future.done():
+                try:
+                    value = future.result()
+                except Exception as e:
+                    print(f"{name} fetch error: {e}")
+            if value is None:
+                results["missing"].append(name)
+                Metrics.incr("source_missing", source=name)
+            results[name] = value
+        return results
+
+    @staticmethod
+    def _within(end, fn):
+        with UpstreamClient.deadline(end):
+            return fn()
+
+class PricePoller:
+    """
+    Process-wide background refresher for GTA prices and exchange rates.
+    Sessions read the latest published snapshot instead of hitting upstream.
+    """
+    INTERVAL = 300 # seconds between refreshes
+
+    def __init__(self, interval=None, fetcher=None, record_history=True):
+        self.interval = interval or PricePoller.INTERVAL
+        # Any callable returning {"prices": ..., "rates": ...}; stubbed in tests/benchmarks
+        self.fetcher = fetcher or PriceAggregator.fetch_all
+        self.record_history = record_history
+        self._snapshot = None
+        self._seq = itertools.count(1) # Snapshot versions; never reused, unlike id()
+        self._listeners = []
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the polling thread once; later calls are no-ops."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="price-poller", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def subscribe(self, callback):
+        """callback(snapshot) runs on the poller thread after every publish."""
+        self._listeners.append(callback)
+        if self._snapshot is not None:
+            callback(self._snapshot)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Poller error: {e}")
+            self._stop.wait(self.interval)
+
+    def refresh(self):
+        """Fetches all upstreams once and publishes a new immutable snapshot."""
+        results = self.fetcher()
+        prices, rates = results.get("prices"), results.get("rates")
+        # Fallback prices arrive marked stale and are published as is, so pages show the delay
+        if not prices and self._snapshot is not None and self._snapshot["prices"]:
+            # Keep serving the last good prices if GTA is unavailable, flagged as delayed
+            prices = dict(self._snapshot["prices"], stale=True)
+        if not rates and self._snapshot is not None:
+            rates = self._snapshot["rates"]
+        # Publish first: a failing history write must not keep fresh prices from sessions
+        self._publish(prices, rates)
+        if prices and self.record_history and not prices.get("stale"):
+            try:
+                DataManager.save_snapshot(prices)
+            except Exception as e:
+                print(f"History write error: {e}")
+
+    def _publish(self, prices, rates):
+        self._snapshot = MappingProxyType({
+            "prices": MappingProxyType(dict(prices)) if prices else None,
+            "rates": MappingProxyType(dict(rates)) if rates else None,
+            "fetched_at": datetime.now(),
+            "seq": next(self._seq),
+        })
+        self._ready.set()
+        for callback in self._listeners:
+            try:
+                callback(self._snapshot)
+            except Exception as e:
+                print(f"Poller listener error: {e}")
+
+    def snapshot(self, timeout=None):
+        """
+        Returns the latest snapshot. Only blocks (up to timeout) before the
+        very first refresh has completed.
+        """
+        if self._snapshot is None:
+            self._ready.wait(timeout)
+        return self._snapshot